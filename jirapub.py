@@ -1,12 +1,20 @@
+from datetime import datetime as dt
+
 import click
 
 from src import AppConfig
 from src import BaseFactory
 from src import IO
 from src import IssueSync
+from src import JiraHelper
 from src import JiraFactory
+from src import Snapshot
+from src import TeamSynchronizer
 from src import TimeSynchronizer
+from src import WorklogReport
+from src import WorklogWebhook
 from src import day_ago_to_datetime
+from src import send_worklog_event
 
 
 def input_createntials(config):
@@ -28,8 +36,9 @@ def input_createntials(config):
 
 
 @click.group()
-def cli():
-    pass
+@click.option('--no-cache', is_flag=True, help='Don\'t use the local cache of JIRA responses.')
+def cli(no_cache):
+    BaseFactory.use_cache = not no_cache
 
 
 @cli.command()
@@ -74,13 +83,28 @@ def issue(issue_key):
 
 @cli.command()
 @click.argument('days_ago', required=False, type=int)
-def issues(days_ago):
+@click.option('--project', '-p', multiple=True, help='SK project key. Can be used several times.')
+@click.option('--type', '-t', 'issue_types', multiple=True, help='SK issue type. Can be used several times.')
+@click.option('--only', type=click.Choice(['assignee', 'worklog']),
+              help='Find only assigned issues or only issues with worklogs.')
+@click.option('--batch-size', default=50, type=click.IntRange(1, 1000), show_default=True,
+              help='Max number of issues in one editor session.')
+@click.option('--output', type=click.Choice(['text', 'jsonl']), default='text', show_default=True,
+              help='`jsonl` prints candidates as JSON lines without migration.')
+@click.option('--bulk', is_flag=True, help='Migrate selected issues without prompts by using bulk requests.')
+@click.option('--rules', type=click.Path(exists=True, dir_okay=False),
+              help='JSON file with summary/estimate/labels rules for bulk migration.')
+@click.option('--full', is_flag=True, help='Search the whole period, not only changes since the previous run.')
+def issues(days_ago, project, issue_types, only, batch_size, output, bulk, rules, full):
     """Migrate non-synchronized tickets from SK to PUB since from DAYS_AGO till NOW
     \b
 
     Finds non-synchronized tickets by using worklogs and assigned tasks in SK for current user.
     Provides git-like interface to choose which tickets have to be migrated.
+    Tickets are shown in batches as soon as they are found.
     After that, it uses `issue` command for each of a task.
+    With `--bulk` selected tasks are created at once without any prompts.
+    Next runs search only tickets updated since the previous one and tickets which are still not migrated.
 
     Can synchronize maximum 1000 days.
     """
@@ -91,12 +115,27 @@ def issues(days_ago):
     else:
         started = IO.input_days_ago(default=14, limit=1000)
 
-    IssueSync(sk, pub).migrate_issues(started)
+    IO.records = output == 'jsonl'
+
+    rules = IssueSync.read_bulk_rules(rules) if bulk else None
+
+    IssueSync(sk, pub).migrate_issues(started, projects=project, issue_types=issue_types, only=only,
+                                      batch_size=batch_size, rules=rules, full=full)
 
 
 @cli.command()
 @click.argument('days_ago', required=False, type=int)
-def time(days_ago):
+@click.option('--shard-days', default=JiraHelper.SHARD_DAYS, type=click.IntRange(1, 1000), show_default=True,
+              help='Size of date windows which are searched concurrently.')
+@click.option('--stream-days', type=click.IntRange(1, 1000),
+              help='Fetch and synchronize the period by chunks of N days instead of loading it at once.')
+@click.option('--output', type=click.Choice(['text', 'jsonl']), default='text', show_default=True,
+              help='`jsonl` prints differences as JSON lines without synchronization.')
+@click.option('--full', is_flag=True, help='Show all tasks, even if they haven\'t changed since the last run.')
+@click.option('--coalesce', is_flag=True, help='Write one SK worklog per task and day with total time.')
+@click.option('--from-snapshot', type=click.Path(exists=True, dir_okay=False),
+              help='Show differences of a snapshot file without any requests and synchronization.')
+def time(days_ago, shard_days, stream_days, output, full, coalesce, from_snapshot):
     """Time synchronization between JIRAs from DAYS_AGO till NOW
 
     Finds existing worklogs in SK and PUB JIRA.
@@ -104,17 +143,180 @@ def time(days_ago):
     Migrates all worklogs from PUB to SK if time differences exists.
     Uses PUB as a primary source.
     Migrates comments for worklogs as well.
+    Tasks which haven't changed since the last run are hidden, use `--full` to show them.
+    With `--from-snapshot` all differences of the snapshot window are shown offline.
 
-    Can synchronize maximum 100 days.
+    Can synchronize maximum 1000 days.
     """
+    if from_snapshot:
+        IO.records = output == 'jsonl'
+
+        with Snapshot(from_snapshot) as snapshot:
+            TimeSynchronizer(None, None, sk_user=snapshot.sk_user, pub_user=snapshot.pub_user).replay(snapshot)
+
+        return
+
     sk, pub = JiraFactory.create()
 
-    if days_ago and 1 <= days_ago < 100:
+    if days_ago and 1 <= days_ago < 1000:
         started = day_ago_to_datetime(days_ago)
     else:
-        started = IO.input_days_ago(default=5, limit=100)
+        started = IO.input_days_ago(default=5, limit=1000)
+
+    IO.records = output == 'jsonl'
+
+    synchronizer = TimeSynchronizer(sk, pub, shard_days=shard_days, coalesce=coalesce)
+
+    if synchronizer.unfinished():
+        IO.error('There are interrupted synchronizations. Please, finish them by using `jirapub resume` command')
+
+    synchronizer.do(started, chunk_days=stream_days, full=full)
+
+
+@cli.command()
+@click.argument('days_ago', type=click.IntRange(1, 999))
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--shard-days', default=JiraHelper.SHARD_DAYS, type=click.IntRange(1, 1000), show_default=True,
+              help='Size of date windows which are searched concurrently.')
+def snapshot(days_ago, path, shard_days):
+    """Store issues and worklogs of both JIRAs from DAYS_AGO till NOW into PATH
+
+    \b
+    The snapshot can be diffed offline by `jirapub time --from-snapshot PATH`.
+    """
+    sk, pub = JiraFactory.create()
+
+    worklogs = TimeSynchronizer(sk, pub, shard_days=shard_days).snapshot(day_ago_to_datetime(days_ago), path)
+
+    IO.success('Stored %d worklogs into %s' % (worklogs, path), nl=True)
+
+
+@cli.command()
+def resume():
+    """Finish interrupted time synchronization
+
+    Uses the journal of synchronizations to remove and add worklogs which weren't processed because of an error.
+    Doesn't search issues again.
+    """
+    sk, pub = JiraFactory.create()
+
+    if not TimeSynchronizer(sk, pub).resume():
+        click.echo('Nothing to do')
+
+
+@cli.command()
+@click.option('--host', default='127.0.0.1', show_default=True)
+@click.option('--port', default=8765, type=int, show_default=True)
+@click.option('--delay', default=WorklogWebhook.DELAY, type=click.IntRange(0, 3600), show_default=True,
+              help='Seconds to wait for more events of the same task and day.')
+@click.option('--coalesce', is_flag=True, help='Write one SK worklog per task and day with total time.')
+def serve(host, port, delay, coalesce):
+    """Time synchronization by PUB webhooks
+
+    Starts HTTP server which receives `worklog_created`, `worklog_updated` and `worklog_deleted` webhooks of PUB.
+    Synchronizes worklogs of the SK task and day of each event without prompts.
+    """
+    BaseFactory.use_cache = False
+
+    sk, pub = JiraFactory.create()
+
+    synchronizer = TimeSynchronizer(sk, pub, quiet=True, coalesce=coalesce)
+
+    WorklogWebhook(synchronizer, pub, pub.current_user(), delay=delay).serve(host, port)
+
+
+@cli.command('send-event')
+@click.argument('pub_key', type=str)
+@click.option('--url', default='http://127.0.0.1:8765/', show_default=True)
+@click.option('--event', type=click.Choice(WorklogWebhook.EVENTS), default='worklog_updated', show_default=True)
+@click.option('--started', default=lambda: dt.now().astimezone().strftime('%Y-%m-%dT%H:%M:%S.000%z'),
+              help='Start time of worklog in JIRA format, now by default.')
+def send_event(pub_key, url, event, started):
+    """
+    Sends a worklog webhook of PUB_KEY issue to `serve` command, like PUB does.
+    """
+    IO.info('Response: %s' % send_worklog_event(url, pub_key, started, event))
+
+
+@cli.command()
+@click.argument('name', type=str)
+def profile(name):
+    """
+    Add or change credentials of team profile NAME.
+    """
+    try:
+        sk_config, pub_config = AppConfig.read_profile(name)
+    except Exception:
+        sk_config, pub_config = AppConfig.read_sk_config(), AppConfig.read_pub_config()
+
+    click.echo('Jira-pub')
+    pub_config = input_createntials(pub_config)
+    pub_config.author = click.prompt('Worklogs author (empty for the user itself)', default='', show_default=False)
+
+    click.echo('\nSK Jira')
+    sk_config = input_createntials(sk_config)
+    sk_config.author = click.prompt('Worklogs author, can\'t be synchronized with --apply (empty for the user itself)',
+                                    default='', show_default=False)
+
+    AppConfig.write_profile(name, sk_config, pub_config)
+    IO.success('Profile %s is saved' % name)
+
+
+@cli.command()
+@click.argument('days_ago', required=False, type=int)
+@click.option('--profile', '-p', 'profiles', multiple=True, help='Team profile. All profiles by default.')
+@click.option('--apply', is_flag=True, help='Synchronize found differences without prompts.')
+@click.option('--workers', default=TeamSynchronizer.WORKERS, type=click.IntRange(1, 64), show_default=True,
+              help='Max number of concurrent requests for all profiles.')
+@click.option('--shard-days', default=JiraHelper.SHARD_DAYS, type=click.IntRange(1, 1000), show_default=True,
+              help='Size of date windows which are searched concurrently.')
+@click.option('--coalesce', is_flag=True, help='Write one SK worklog per task and day with total time.')
+def team(days_ago, profiles, apply, workers, shard_days, coalesce):
+    """Time synchronization for team profiles from DAYS_AGO till NOW
+
+    Finds differences of worklogs for every profile added by `profile` command and prints summary per profile.
+    Differences are synchronized only with `--apply`.
+
+    Can synchronize maximum 1000 days.
+    """
+    profiles = list(profiles) or AppConfig.read_profiles()
+    if not profiles:
+        IO.error('There are no profiles. Please, add them by using `jirapub profile NAME` command')
+        return
+
+    if days_ago and 1 <= days_ago < 1000:
+        started = day_ago_to_datetime(days_ago)
+    else:
+        started = IO.input_days_ago(default=5, limit=1000)
+
+    TeamSynchronizer(profiles, workers=workers, shard_days=shard_days, coalesce=coalesce).do(started, apply=apply)
+
+
+@cli.command()
+@click.argument('days_ago', required=False, type=int)
+@click.option('--group', '-g', type=click.Choice(WorklogReport.GROUPS), default='day', show_default=True,
+              help='Aggregate worklogs by day, issue, project or SK key.')
+@click.option('--format', '-f', 'output_format', type=click.Choice(['csv', 'json']), default='csv',
+              show_default=True)
+@click.option('--output', '-o', type=click.File('w'), default='-', help='Output file, stdout by default.')
+def report(days_ago, group, output_format, output):
+    """Worklogs report of both JIRAs from DAYS_AGO till NOW
+
+    Aggregates SK and PUB worklogs of current user and shows differences between them.
+
+    Can use maximum 1000 days.
+    """
+    sk, pub = JiraFactory.create()
+
+    if days_ago and 1 <= days_ago < 1000:
+        started = day_ago_to_datetime(days_ago)
+    else:
+        started = IO.input_days_ago(default=30, limit=1000)
+
+    sk_collection, pub_collection = TimeSynchronizer(sk, pub, quiet=True).fetch(started)
+
+    WorklogReport.from_collections(sk_collection, pub_collection).write(output, group, output_format)
 
-    TimeSynchronizer(sk, pub).do(started)
 
 if __name__ == '__main__':
     cli()
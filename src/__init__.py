@@ -3,4 +3,8 @@ from src.jira_factory import JiraFactory, BaseFactory
 from src.io import IO, day_ago_to_datetime
 from src.issue_synchronizer import IssueSync
 from src.time_synchronizer import TimeSynchronizer
-from src.jira_helper import PubHelper
+from src.jira_helper import JiraHelper, PubHelper
+from src.report import WorklogReport
+from src.snapshot import Snapshot
+from src.team_synchronizer import TeamSynchronizer
+from src.webhook import WorklogWebhook, send_worklog_event
@@ -24,6 +24,17 @@ class AppConfig:
     def get_dir_path(cls):
         return click.get_app_dir(cls.APP_NAME, False, False)
 
+    @classmethod
+    def get_app_file_path(cls, name):
+        """
+        Get path of a file inside of the app dir. Creates the dir if needed.
+        """
+        dir_path = cls.get_dir_path()
+        if not os.path.isdir(dir_path):
+            os.makedirs(dir_path, exist_ok=True)
+
+        return os.path.join(dir_path, name)
+
     @classmethod
     def write_hidden_keys(cls, hidden_keys, rewrite=False):
         config = cls._read()
@@ -71,6 +82,34 @@ class AppConfig:
     def write_sk_config(cls, jira_config):
         return cls._write_jira_config(cls.SK_SECTION, jira_config)
 
+    @classmethod
+    def read_profiles(cls):
+        """
+        Get names of team profiles.
+        """
+        prefix = cls.SK_SECTION + ':'
+
+        return [section[len(prefix):] for section in cls._read().sections() if section.startswith(prefix)]
+
+    @classmethod
+    def read_profile(cls, name):
+        """
+        Get SK and PUB configs of team profile.
+
+        :rtype: (JiraConfig, JiraConfig)
+        """
+        return cls._read_jira_config(cls._profile_section(cls.SK_SECTION, name)), \
+            cls._read_jira_config(cls._profile_section(cls.PUB_SECTION, name))
+
+    @classmethod
+    def write_profile(cls, name, sk_config, pub_config):
+        cls._write_jira_config(cls._profile_section(cls.SK_SECTION, name), sk_config)
+        cls._write_jira_config(cls._profile_section(cls.PUB_SECTION, name), pub_config)
+
+    @classmethod
+    def _profile_section(cls, section, name):
+        return '%s:%s' % (section, name)
+
     @classmethod
     def _read_jira_config(cls, section):
         config = cls._read()
@@ -78,8 +117,9 @@ class AppConfig:
         url = config.get(section, 'url')
         username = config.get(section, 'username')
         password = config.get(section, 'password')
+        author = config.get(section, 'author') if config.has_option(section, 'author') else None
 
-        return JiraConfig(url, username, password)
+        return JiraConfig(url, username, password, author)
 
     @classmethod
     def _read(cls):
@@ -107,14 +147,23 @@ class AppConfig:
         config.set(section, 'username', jira_config.username)
         config.set(section, 'password', jira_config.password)
 
+        if jira_config.author:
+            config.set(section, 'author', jira_config.author)
+        elif config.has_option(section, 'author'):
+            config.remove_option(section, 'author')
+
         cls._write(config)
 
 
 class JiraConfig:
-    def __init__(self, url=None, username=None, password=None):
+    def __init__(self, url=None, username=None, password=None, author=None):
+        """
+        :param author: whose worklogs are synchronized, the user of credentials by default.
+        """
         self.url = url
         self.username = username
         self.password = password
+        self.author = author
 
     def valid(self):
         return self.url and self.username and self.password
@@ -0,0 +1,84 @@
+import json
+import os
+from datetime import timedelta as td
+
+from src.config import AppConfig
+
+
+class DiscoveryCursor(object):
+    """
+    State of `jirapub issues` between runs, stored in the app dir per search filter.
+
+    It keeps time of the last full look, candidates which weren't migrated or hidden yet and keys which are known to
+    be migrated already. Next runs search only issues updated since the cursor plus the stored candidates.
+    """
+    FILE_NAME = 'issues_cursor.json'
+
+    # JQL dates are in the timezone of JIRA user, so the cursor is moved back to cover any difference.
+    MARGIN = td(days=1)
+
+    # Candidates are sent in JQL, too long list falls back to the full search.
+    MAX_CANDIDATES = 300
+
+    def __init__(self, name, path=None):
+        """
+        :param name: key of the search filter, cursors of different filters are independent.
+        """
+        self._name = name
+        self._path = path or AppConfig.get_app_file_path(self.FILE_NAME)
+        self._items = {}
+
+        if os.path.isfile(self._path):
+            try:
+                with open(self._path) as f:
+                    self._items = json.load(f)
+            except ValueError:
+                self._items = {}
+
+        state = self._items.get(name, {})
+
+        self.since = state.get('since')
+        self.cursor = state.get('cursor')
+        self.candidates = state.get('candidates', [])
+        self.migrated = set(state.get('migrated', []))
+
+    def applies(self, started):
+        """
+        Cursor can be used if it was set by a run which looked at the same window or a wider one.
+
+        :type started: datetime.datetime
+        """
+        return self.cursor is not None and self.since <= started.strftime('%Y-%m-%d') \
+            and len(self.candidates) <= self.MAX_CANDIDATES
+
+    def jql(self, jql):
+        """
+        Narrow down JQL of the full search to the delta since the cursor.
+        """
+        clause = 'updatedDate >= "%s"' % self.cursor
+
+        if self.candidates:
+            clause += " or key in ('%s')" % "','".join(self.candidates)
+
+        return '%s and (%s)' % (jql, clause)
+
+    def save(self, started, run_started, candidates, migrated):
+        """
+        :param started: start of the searched window.
+        :param run_started: local time when the search was started.
+        :param candidates: keys of issues which are still not migrated.
+        :param migrated: keys of issues which are found in PUB.
+        """
+        self._items[self._name] = {
+            'since': started.strftime('%Y-%m-%d'),
+            'cursor': (run_started - self.MARGIN).strftime('%Y/%m/%d %H:%M'),
+            'candidates': sorted(set(candidates) - set(migrated)),
+            'migrated': sorted(migrated),
+        }
+
+        with open(self._path, 'w') as f:
+            json.dump(self._items, f)
+
+    @classmethod
+    def name(cls, projects=None, issue_types=None, only=None):
+        return json.dumps([sorted(projects or []), sorted(issue_types or []), only or ''])
@@ -0,0 +1,202 @@
+import json
+import os
+import time
+
+from src.config import AppConfig
+from src.io import IO as io
+
+
+class FieldMappingException(Exception):
+    def __init__(self, message):
+        self.message = message
+
+
+class CreateMeta(object):
+    """
+    PUB create metadata (project, issue types, priorities and required fields), cached in the app dir.
+
+    Servers without `createmeta` give empty metadata, fields are checked by the server itself then.
+    """
+    FILE_NAME = 'createmeta.json'
+
+    def __init__(self, project, available=True):
+        """
+        :type project: dict
+        :param available: False if metadata couldn't be fetched and `project` has the key only.
+        """
+        self.project = project
+        self.available = available
+        self._issue_types = {str(issue_type['id']): issue_type for issue_type in project.get('issuetypes', [])}
+
+    @classmethod
+    def load(cls, pub_jira, project_key, ttl):
+        """
+        Get metadata from the local cache or from PUB if the cache is older than `ttl` seconds.
+
+        :type pub_jira: jira.JIRA
+        :type project_key: str
+        :type ttl: int
+
+        :rtype: CreateMeta
+        """
+        path = AppConfig.get_app_file_path(cls.FILE_NAME)
+
+        cache = {}
+        if os.path.isfile(path):
+            try:
+                with open(path) as f:
+                    cache = json.load(f)
+            except ValueError:
+                cache = {}
+
+        item = cache.get(project_key)
+        if item is None or time.time() - item['fetched'] > ttl:
+            try:
+                meta = pub_jira.createmeta(projectKeys=project_key, expand='projects.issuetypes.fields')
+            except Exception as e:
+                # The endpoint was removed in JIRA 9, the jira library raises for such servers.
+                io.warning('Can\'t get PUB create metadata, fields aren\'t checked locally: %s' % e, nl=True)
+
+                return cls({'key': project_key}, available=False)
+
+            projects = meta.get('projects', [])
+            if not projects:
+                raise FieldMappingException('Can\'t find PUB project %s' % project_key)
+
+            item = cache[project_key] = {'fetched': time.time(), 'project': projects[0]}
+
+            with open(path, 'w') as f:
+                json.dump(cache, f)
+
+        return cls(item['project'])
+
+    @property
+    def project_ref(self):
+        """
+        Value of `project` field of a new issue.
+        """
+        if 'id' not in self.project:
+            return {'key': self.project['key']}
+
+        return {'id': str(self.project['id'])}
+
+    def issue_type_name(self, issue_type_id):
+        issue_type = self._issue_types.get(str(issue_type_id))
+
+        return issue_type['name'] if issue_type else None
+
+    def field(self, issue_type_id, field_id):
+        issue_type = self._issue_types.get(str(issue_type_id), {})
+
+        return issue_type.get('fields', {}).get(field_id)
+
+    def required_fields(self, issue_type_id):
+        issue_type = self._issue_types.get(str(issue_type_id), {})
+
+        return [field_id for field_id, field in issue_type.get('fields', {}).items() if
+                field.get('required') and not field.get('hasDefaultValue')]
+
+    def allowed_ids(self, issue_type_id, field_id):
+        """
+        Get ids of allowed values or None if the field isn't restricted.
+        """
+        field = self.field(issue_type_id, field_id)
+        if not field or 'allowedValues' not in field:
+            return None
+
+        return set(str(value['id']) for value in field['allowedValues'])
+
+
+class FieldMapping(object):
+    """
+    Compiled SK -> PUB mapping of fields. Can be overridden by `mapping.json` in the app dir:
+
+        {"project": "SheknowsDT", "priority": {"7": "3"}, "issuetype": {"10": "3"}}
+    """
+    FILE_NAME = 'mapping.json'
+
+    PROJECT = 'SheknowsDT'
+
+    CREATEMETA_TTL = 24 * 60 * 60
+
+    # You can find all of them by /rest/api/2/priority.
+    PRIORITY = {
+        '1': '1',  # Blocker
+        '2': '2',  # Critical
+        '3': '3',  # Major
+        '7': '3',  # Important -> Major
+        '4': '4',  # Minor
+        '5': '5',  # Trivial
+    }
+    DEFAULT_PRIORITY = '4'
+
+    # You can find all types by /rest/api/2/issuetype.
+    ISSUE_TYPE = {
+        '1': '1',  # Bug
+        '3': '3',  # Task
+    }
+    DEFAULT_ISSUE_TYPE = '3'
+
+    def __init__(self, rules=None):
+        rules = rules or {}
+
+        self.project = rules.get('project', self.PROJECT)
+        self.createmeta_ttl = int(rules.get('createmeta_ttl', self.CREATEMETA_TTL))
+
+        self._priority = self._compile(self.PRIORITY, rules.get('priority'))
+        self._default_priority = str(rules.get('default_priority', self.DEFAULT_PRIORITY))
+
+        self._issue_type = self._compile(self.ISSUE_TYPE, rules.get('issuetype'))
+        self._default_issue_type = str(rules.get('default_issuetype', self.DEFAULT_ISSUE_TYPE))
+
+    @classmethod
+    def from_config(cls):
+        """
+        :rtype: FieldMapping
+        """
+        path = os.path.join(AppConfig.get_dir_path(), cls.FILE_NAME)
+        if not os.path.isfile(path):
+            return cls()
+
+        with open(path) as f:
+            return cls(json.load(f))
+
+    @classmethod
+    def _compile(cls, defaults, overrides):
+        table = dict(defaults)
+        table.update({str(sk_id): str(pub_id) for sk_id, pub_id in (overrides or {}).items()})
+
+        return table
+
+    def priority(self, sk_priority):
+        return {'id': self._priority.get(str(sk_priority.id), self._default_priority)}
+
+    def issue_type(self, sk_type):
+        return {'id': self._issue_type.get(str(sk_type.id), self._default_issue_type)}
+
+    def validate(self, fields, meta):
+        """
+        Check PUB fields against create metadata before sending them to the server.
+
+        :type fields: dict
+        :type meta: CreateMeta
+        """
+        if not meta.available:
+            return
+
+        errors = []
+
+        issue_type_id = fields['issuetype']['id']
+        if meta.issue_type_name(issue_type_id) is None:
+            errors.append('issue type %s is not available in %s' % (issue_type_id, self.project))
+        else:
+            allowed = meta.allowed_ids(issue_type_id, 'priority')
+            if allowed is not None and fields['priority']['id'] not in allowed:
+                errors.append('priority %s is not allowed' % fields['priority']['id'])
+
+            missing = [field_id for field_id in meta.required_fields(issue_type_id) if not fields.get(field_id)]
+            if missing:
+                errors.append('required fields are missing: %s' % ', '.join(sorted(missing)))
+
+        if errors:
+            raise FieldMappingException('Invalid fields of %s: %s' % (fields.get('summary'), '; '.join(errors)))
@@ -0,0 +1,60 @@
+import hashlib
+import json
+import os
+from datetime import datetime as dt, timedelta as td
+
+from src.config import AppConfig
+
+
+class Fingerprints(object):
+    """
+    Fingerprints of synchronized worklogs per SK key and day, stored in the app dir between runs.
+    """
+    FILE_NAME = 'fingerprints.json'
+
+    # Fingerprints of older days are dropped on save.
+    KEEP_DAYS = 400
+
+    def __init__(self, path=None):
+        self._path = path or AppConfig.get_app_file_path(self.FILE_NAME)
+        self._items = {}
+
+        if os.path.isfile(self._path):
+            try:
+                with open(self._path) as f:
+                    self._items = json.load(f)
+            except ValueError:
+                self._items = {}
+
+    @classmethod
+    def of(cls, sk_worklogs, pub_worklogs):
+        """
+        Fingerprint of SK and PUB worklogs of a day.
+
+        :type sk_worklogs: src.jira_container.WorklogsCollection
+        :type pub_worklogs: list
+        """
+        items = [sorted(cls._worklog_items(worklogs)) for worklogs in (sk_worklogs, pub_worklogs)]
+
+        return hashlib.sha1(json.dumps(items).encode()).hexdigest()
+
+    @classmethod
+    def _worklog_items(cls, worklogs):
+        return [[str(worklog.id), worklog.total_time, getattr(worklog, 'updated', '')] for worklog in worklogs]
+
+    def matches(self, sk_key, date, fingerprint):
+        return self._items.get(self._key(sk_key, date)) == fingerprint
+
+    def set(self, sk_key, date, fingerprint):
+        self._items[self._key(sk_key, date)] = fingerprint
+
+    def save(self):
+        oldest = (dt.now() - td(days=self.KEEP_DAYS)).strftime('%Y-%m-%d')
+
+        self._items = {key: value for key, value in self._items.items() if key.split('|')[1] >= oldest}
+
+        with open(self._path, 'w') as f:
+            json.dump(self._items, f)
+
+    def _key(self, sk_key, date):
+        return '%s|%s' % (sk_key, date.strftime('%Y-%m-%d'))
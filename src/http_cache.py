@@ -0,0 +1,178 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from requests import Response
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from src.config import AppConfig
+
+
+class HttpCache(object):
+    """
+    Persistent LRU cache of GET responses, stored in sqlite in the app dir.
+    """
+    FILE_NAME = 'http_cache.sqlite'
+
+    TTL = 120
+    MAX_SIZE = 50 * 1024 * 1024
+
+    # Body is stored decoded, so these headers don't describe it anymore.
+    SKIP_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding')
+
+    def __init__(self, path=None, ttl=TTL, max_size=MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path or AppConfig.get_app_file_path(self.FILE_NAME), check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, url TEXT, headers TEXT, '
+                         'body BLOB, etag TEXT, modified TEXT, stored REAL, accessed REAL, size INTEGER)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+
+        # Running total of stored bodies, so puts under the budget don't scan the table.
+        self._size = self._total_size()
+
+    @classmethod
+    def key(cls, request):
+        auth = request.headers.get('Authorization', '')
+
+        return hashlib.sha256(('%s %s %s' % (request.method, request.url, auth)).encode()).hexdigest()
+
+    def get(self, key):
+        """
+        :rtype: dict or None
+        """
+        with self._lock:
+            row = self._db.execute('SELECT headers, body, etag, modified, stored FROM responses WHERE key = ?',
+                                   (key,)).fetchone()
+
+        if row is None:
+            return None
+
+        return {'headers': json.loads(row[0]), 'body': row[1], 'etag': row[2], 'modified': row[3], 'stored': row[4]}
+
+    def put(self, key, response):
+        headers = {name: value for name, value in response.headers.items() if name.lower() not in self.SKIP_HEADERS}
+        body = response.content
+        now = time.time()
+
+        with self._lock, self._db:
+            row = self._db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+
+            self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                             (key, response.url, json.dumps(headers), body, response.headers.get('ETag'),
+                              response.headers.get('Last-Modified'), now, now, len(body)))
+
+            self._size += len(body) - (row[0] if row else 0)
+
+            if self._size > self.max_size:
+                self._evict()
+
+    def touch(self, key, revalidated=False):
+        now = time.time()
+
+        with self._lock, self._db:
+            if revalidated:
+                self._db.execute('UPDATE responses SET stored = ?, accessed = ? WHERE key = ?', (now, now, key))
+            else:
+                self._db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+
+    def invalidate_unvalidated(self):
+        """
+        Remove entries which can't be revalidated by the server, the rest are checked on every request anyway.
+        """
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM responses WHERE etag IS NULL AND modified IS NULL')
+            self._size = self._total_size()
+
+    def is_fresh(self, entry):
+        return time.time() - entry['stored'] < self.ttl
+
+    def _total_size(self):
+        return self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def _evict(self):
+        # Other processes may use the same file, so the total is checked before removing anything.
+        self._size = self._total_size()
+
+        for key, size in self._db.execute('SELECT key, size FROM responses ORDER BY accessed').fetchall():
+            if self._size <= self.max_size:
+                break
+
+            self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self._size -= size
+
+
+class CachingAdapter(HTTPAdapter):
+    """
+    Transport adapter which serves GET requests from HttpCache.
+
+    Entries with ETag/Last-Modified are revalidated by conditional requests, the rest are served within TTL.
+    """
+    # POST requests which don't change anything.
+    READ_ONLY_POSTS = ('/search',)
+
+    def __init__(self, cache, *args, **kwargs):
+        """
+        :type cache: HttpCache
+        """
+        super().__init__(*args, **kwargs)
+
+        self.cache = cache
+
+    def send(self, request, stream=False, **kwargs):
+        if request.method != 'GET':
+            response = super().send(request, stream=stream, **kwargs)
+
+            if response.status_code < 400 and not request.path_url.split('?')[0].endswith(self.READ_ONLY_POSTS):
+                self.cache.invalidate_unvalidated()
+
+            return response
+
+        if stream or 'no-store' in request.headers.get('Cache-Control', ''):
+            return super().send(request, stream=stream, **kwargs)
+
+        key = self.cache.key(request)
+        entry = self.cache.get(key)
+
+        if entry is not None:
+            if entry['etag']:
+                request.headers['If-None-Match'] = entry['etag']
+            if entry['modified']:
+                request.headers['If-Modified-Since'] = entry['modified']
+
+            if not entry['etag'] and not entry['modified'] and self.cache.is_fresh(entry):
+                self.cache.touch(key)
+
+                return self._cached_response(request, entry)
+
+        response = super().send(request, stream=stream, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            response.close()
+            self.cache.touch(key, revalidated=True)
+
+            return self._cached_response(request, entry)
+
+        if response.status_code == 200 and 'no-store' not in response.headers.get('Cache-Control', ''):
+            self.cache.put(key, response)
+
+        return response
+
+    def _cached_response(self, request, entry):
+        response = Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = entry['body']
+        response.url = request.url
+        response.request = request
+        response.connection = self
+
+        return response
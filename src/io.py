@@ -1,4 +1,6 @@
+import json
 import re
+from collections import OrderedDict
 from datetime import datetime as dt, timedelta as td, timezone
 
 import click
@@ -21,6 +23,9 @@ class InputException(Exception):
 class IO:
     STATUS_COLOR = {'info': 'white', 'error': 'red', 'warning': 'yellow', 'success': 'green'}
 
+    # Print JSON lines instead of human readable output.
+    records = False
+
     @classmethod
     def input_days_ago(cls, default=None, limit=100):
         num = 0
@@ -131,21 +136,38 @@ class IO:
 
     @classmethod
     def error(cls, msg, nl=False):
-        cls.message(click.style('ERROR: ', fg='red') + msg, nl)
+        cls.message(click.style('ERROR: ', fg='red') + msg, nl, err=cls.records)
+
+    @classmethod
+    def warning(cls, msg, nl=False):
+        cls.message(click.style('WARNING: ', fg='yellow') + msg, nl, err=cls.records)
 
     @classmethod
     def info(cls, msg, nl=False):
         cls.message(msg, nl)
 
     @classmethod
-    def message(cls, msg, nl=False):
+    def message(cls, msg, nl=False, err=False):
+        if cls.records and not err:
+            return
+
         if nl:
-            click.echo()
+            click.echo(err=err)
+
+        click.echo(msg, err=err)
 
-        click.echo(msg)
+    @classmethod
+    def record(cls, kind, **fields):
+        """
+        Print one JSON line. Human readable messages are not printed in records mode, errors go to stderr.
+        """
+        record = OrderedDict(type=kind)
+        record.update(sorted(fields.items()))
+
+        click.echo(json.dumps(record))
 
     @classmethod
-    def edit_unsync_issues(cls, issues):
+    def edit_unsync_issues(cls, issues, batch=None):
         """
         Allows a user to manage all new tasks. They can have three statuses: migrate, skip and hide.
         """
@@ -157,6 +179,8 @@ class IO:
 # h = hide issue (skip and never migrate).
         """
 
+        footer = '# Batch #%d\n' % batch if batch else ''
+
         max_len = max([len(issue.fields.summary) for issue in issues])
         max_len = max_len if max_len < 200 else 200
 
@@ -168,7 +192,7 @@ class IO:
         items = [line_format(issue) for issue in issues]
 
         while True:
-            message = click.edit("\n".join(items) + '\n\n' + MARKER)
+            message = click.edit("\n".join(items) + '\n\n' + MARKER + footer)
             if message is None:
                 raise Abort
 
@@ -191,20 +215,21 @@ class IO:
         """
         result = {'m': [], 's': [], 'h': []}
 
+        pending = OrderedDict((issue.key, issue) for issue in issues)
+
         for num, line in enumerate(lines):
             r = re.match(r"(?P<mode>m|s|h)\s*(?P<key>\w+-\d+)\b.*", line)
             if r is None:
                 raise InputException('Invalid line #%s' % str(num + 1))
 
             key = r.group('key')
-            issue = next((issue for issue in issues if issue.key == key), None)
+            issue = pending.pop(key, None)
 
             if issue is None:
                 raise InputException('Can\'t find issue by key % s' % key)
 
             result[r.group('mode')].append(issue)
-            issues.remove(issue)
 
-        result['s'] += issues
+        result['s'] += list(pending.values())
 
         return result['m'], result['s'], result['h']
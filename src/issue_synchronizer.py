@@ -1,20 +1,35 @@
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime as dt
 
 import click
 
 import src.config as config
+from src.discovery_cursor import DiscoveryCursor
+from src.field_mapping import CreateMeta, FieldMapping, FieldMappingException
 from src.io import IO as io
 from src.jira_container import PubIssue
-from src.jira_helper import PubHelper
+from src.jira_helper import JiraHelper, PubHelper, chunks
 
 
 class IssueSync(object):
+    BULK_CHUNK = 50
+    ATTACHMENT_WORKERS = 8
+
+    # Number of SK issues which are loaded in advance, their attachments are kept in memory.
+    PREFETCH_DEPTH = 3
+
     def __init__(self, sk_jira, pub_jira):
         self._sk_jira = sk_jira
         self._pub_jira = pub_jira
 
+        self._sk_helper = JiraHelper(sk_jira)
         self._pub_helper = PubHelper(pub_jira)
 
+        self._mapping = FieldMapping.from_config()
+        self._meta = None
+
     def migrate(self, sk_key):
         """
         Migrates issue from SK to PUB.
@@ -26,16 +41,10 @@ class IssueSync(object):
 
             return
 
-        pub_issues = self._pub_jira.search_issues("'External issue ID' ~ '%s'" % sk_issue.permalink())
-
-        if pub_issues:
-            click.echo('\nThis task has been already migrated to PUB: ')
-
-            for issue in pub_issues:
-                click.echo(io.highlight_key(issue=issue) + '\t' + io.truncate_summary(issue.fields.summary))
+        pub_issues = self._find_pub_issues(sk_issue)
 
-            if not click.confirm('\nContinue?', default=False):
-                return
+        if not self._confirm_remigration(pub_issues):
+            return
 
         click.echo('Beginning of migration %s' % io.highlight_key(issue=sk_issue))
 
@@ -50,41 +59,318 @@ class IssueSync(object):
 
         return pub_issue
 
-    def migrate_issues(self, started):
+    def migrate_many(self, sk_keys):
+        """
+        Migrates issues from SK to PUB one by one.
+
+        Upcoming SK issues and their attachments are loaded in background while the current one is being confirmed,
+        confirmed issues are created and get their attachments in background as well.
+
+        :type sk_keys: list
+        :return: list of created PUB issues
+        """
+        pending = deque(sk_keys)
+        prefetched = deque()
+        created = []
+
+        with ThreadPoolExecutor(max_workers=self.PREFETCH_DEPTH) as prefetcher, \
+                ThreadPoolExecutor(max_workers=self.ATTACHMENT_WORKERS) as writer:
+            while pending or prefetched:
+                while pending and len(prefetched) < self.PREFETCH_DEPTH:
+                    sk_key = pending.popleft()
+                    prefetched.append((sk_key, prefetcher.submit(self._prefetch, sk_key)))
+
+                sk_key, future = prefetched.popleft()
+
+                try:
+                    sk_issue, pub_issues, attachments = future.result()
+                except Exception:
+                    io.error('Can\'t find the issue by key: %s' % sk_key, nl=True)
+                    continue
+
+                click.echo('\nMigration of %s' % io.highlight_key(issue=sk_issue))
+
+                if not self._confirm_remigration(pub_issues):
+                    continue
+
+                fields = self.prepare_fields(sk_issue)
+                if fields is not None:
+                    created.append((sk_issue, writer.submit(self._create_with_attachments, fields, attachments)))
+
+            if created:
+                io.info('Waiting for migration...', nl=True)
+
+        pub_issues = []
+
+        for sk_issue, future in created:
+            try:
+                pub_issue = future.result()
+            except Exception as e:
+                io.error('%s was not migrated: %s' % (sk_issue.key, e))
+                continue
+
+            click.echo('Issue was migrated: %s -> %s' % (io.highlight_key(issue=sk_issue),
+                                                          io.highlight_key(issue=pub_issue)))
+            pub_issues.append(pub_issue)
+
+        return pub_issues
+
+    def _prefetch(self, sk_key):
+        """
+        Loads everything that migration of SK issue needs.
+
+        :return: SK issue, PUB issues which are linked with it and list of (filename, content) of attachments
+        """
+        sk_issue = self._sk_jira.issue(sk_key)
+        pub_issues = self._find_pub_issues(sk_issue)
+        attachments = [(attachment.filename, attachment.get()) for attachment in sk_issue.fields.attachment or []]
+
+        return sk_issue, pub_issues, attachments
+
+    def _create_with_attachments(self, fields, attachments):
+        pub_issue = self._pub_jira.create_issue(fields=fields)
+
+        for filename, content in attachments:
+            self._pub_jira.add_attachment(pub_issue, content, filename=filename)
+
+        return pub_issue
+
+    def _find_pub_issues(self, sk_issue):
+        return self._pub_helper.get_issues_by_sk_links([sk_issue.permalink()])
+
+    def _confirm_remigration(self, pub_issues):
+        """
+        Asks a user if an issue has to be migrated again, if it's already migrated.
+        """
+        if not pub_issues:
+            return True
+
+        click.echo('\nThis task has been already migrated to PUB: ')
+
+        for issue in pub_issues:
+            click.echo(io.highlight_key(issue=issue) + '\t' + io.truncate_summary(issue.fields.summary))
+
+        return click.confirm('\nContinue?', default=False)
+
+    def migrate_issues(self, started, projects=None, issue_types=None, only=None, batch_size=50, rules=None,
+                       full=False):
         """
         Migrates issues from SK to PUB.
 
+        Candidates are shown in the editor batch by batch while search pages are still being loaded. After the first
+        run only issues updated since the previous one and not migrated candidates are searched.
+
         :param started:
+        :param projects: SK project keys to look in.
+        :param issue_types: SK issue type names to look for.
+        :param only: 'assignee' or 'worklog' to narrow down how an issue is related to the current user.
+        :param batch_size: max number of issues in one editor session.
+        :param rules: dict of bulk rules. Selected issues are migrated without prompts if it's passed.
+        :param full: search the whole window ignoring the stored cursor.
         :return:
         """
+        run_started = dt.now()
+
+        jql = self.unsync_issues_jql(started, projects, issue_types, only)
+
+        cursor = DiscoveryCursor(DiscoveryCursor.name(projects, issue_types, only))
+        if not full and cursor.applies(started):
+            jql = cursor.jql(jql)
+
+        hidden_keys = set(config.AppConfig.read_hidden_keys())
+        migrated_keys = set(cursor.migrated)
+        candidates = []
+
+        batches = 0
+        for new_issues in self._unsync_issues_batches(jql, hidden_keys, batch_size, migrated_keys):
+            batches += 1
+
+            if io.records:
+                [self._print_record(issue) for issue in new_issues]
+                continue
+
+            m_issues, s_issues, h_issues = io.edit_unsync_issues(new_issues, batch=batches)
+
+            h_keys = [h_issue.key for h_issue in h_issues]
+            config.AppConfig.write_hidden_keys(h_keys)
+
+            # Migrated issues stay candidates until they are found in PUB, so failed ones aren't lost.
+            candidates += [issue.key for issue in m_issues + s_issues]
+
+            if rules is not None:
+                self.bulk_migrate(m_issues, rules)
+                continue
+
+            self.migrate_many([issue.key for issue in m_issues])
+
+        if not io.records:
+            cursor.save(started, run_started, candidates, migrated_keys)
+
+        if not batches:
+            io.info('Nothing to do')
+
+    def _print_record(self, sk_issue):
+        """
+        Print migration candidate as JSON line.
+        """
+        io.record('issue', key=sk_issue.key, summary=sk_issue.fields.summary, link=sk_issue.permalink(),
+                  project=sk_issue.fields.project.key, issuetype=sk_issue.fields.issuetype.name)
+
+    @classmethod
+    def unsync_issues_jql(cls, started, projects=None, issue_types=None, only=None):
+        """
+        Builds JQL for searching of SK issues which are related to the current user.
+        """
         today = dt.today().replace(tzinfo=started.tzinfo)
         days = int((today - started).days) + 1
 
-        sk_issues = self._sk_jira.search_issues(
-            'createdDate >= startOfDay(-%dd) and (assignee=currentUser() or worklogAuthor=currentUser())' % days,
-            maxResults=100000)
+        relations = {
+            'assignee': 'assignee=currentUser()',
+            'worklog': 'worklogAuthor=currentUser()',
+        }
+
+        jql = 'createdDate >= startOfDay(-%dd)' % days
 
-        pub_issues = self._pub_helper.get_issues_by_sk_links([sk_issue.permalink() for sk_issue in sk_issues])
+        if only:
+            jql += ' and ' + relations[only]
+        else:
+            jql += ' and (%s or %s)' % (relations['assignee'], relations['worklog'])
 
-        exists_sk_links = [PubIssue(issue).sk_url for issue in pub_issues]
+        if projects:
+            jql += " and project in ('%s')" % "','".join(projects)
 
-        new_issues = [issue for issue in sk_issues if issue.permalink() not in exists_sk_links]
+        if issue_types:
+            jql += " and issuetype in ('%s')" % "','".join(issue_types)
 
-        if not new_issues:
-            click.echo('Nothing to do')
-            return
+        return jql
+
+    def _unsync_issues_batches(self, jql, hidden_keys, batch_size, migrated_keys):
+        """
+        Yields batches of SK issues which haven't been migrated to PUB yet.
+
+        :param migrated_keys: keys which are known to be migrated, they aren't looked up in PUB. Keys of issues which
+        are found in PUB are added to it.
+        :type migrated_keys: set
+        """
+        batch = []
+
+        # The next page is requested only after the previous batch is edited and migrated, issues which are created
+        # meanwhile have to go to the end, so already loaded pages don't shift.
+        for sk_issues in self._sk_helper.search_pages(jql + ' ORDER BY created ASC, key ASC', page_size=batch_size):
+            sk_issues = [issue for issue in sk_issues if
+                         issue.key not in hidden_keys and issue.key not in migrated_keys]
+            if not sk_issues:
+                continue
+
+            pub_issues = self._pub_helper.get_issues_by_sk_links([sk_issue.permalink() for sk_issue in sk_issues])
+
+            exists_sk_links = set(PubIssue(issue).sk_url for issue in pub_issues)
+
+            migrated_keys.update(issue.key for issue in sk_issues if issue.permalink() in exists_sk_links)
 
-        hidden_keys = config.AppConfig.read_hidden_keys()
+            batch += [issue for issue in sk_issues if issue.permalink() not in exists_sk_links]
 
-        new_issues = [issue for issue in new_issues if issue.key not in hidden_keys]
+            if len(batch) >= batch_size:
+                yield batch[:batch_size]
+                batch = batch[batch_size:]
 
-        m_issues, s_issues, h_issues = io.edit_unsync_issues(new_issues)
+        if batch:
+            yield batch
 
-        h_keys = [h_issue.key for h_issue in h_issues]
-        config.AppConfig.write_hidden_keys(h_keys)
+    def bulk_migrate(self, sk_issues, rules):
+        """
+        Migrates already fetched SK issues without any prompts.
+
+        Issues are created by bulk requests, attachments are uploaded concurrently afterwards.
+
+        :param sk_issues: list of SK issues
+        :param rules: dict of bulk rules, see `read_bulk_rules`
+        :return: list of created PUB issues
+        """
+        if not sk_issues:
+            return []
+
+        sk_by_link = {sk_issue.permalink(): sk_issue for sk_issue in sk_issues}
+        field_list = []
+
+        for sk_issue in sk_issues:
+            fields = self.bulk_fields(sk_issue, rules)
+
+            try:
+                self._mapping.validate(fields, self.meta)
+            except FieldMappingException as e:
+                io.error(e.message, nl=True)
+
+                continue
+
+            field_list.append(fields)
 
-        for issue in m_issues:
-            self.migrate(issue.key)
+        migrated = []
+
+        with click.progressbar(length=len(field_list), label='Creating PUB issues') as bar:
+            for chunk in chunks(field_list, self.BULK_CHUNK):
+                # Key and id of created issues are enough for links and attachments, they aren't requested again.
+                for result in self._pub_jira.create_issues(field_list=chunk, prefetch=False):
+                    sk_issue = sk_by_link[result['input_fields']['customfield_11470']]
+
+                    if result['status'] == 'Success':
+                        migrated.append((sk_issue, result['issue']))
+                    else:
+                        io.error('%s was not migrated: %s' % (sk_issue.key, result['error']), nl=True)
+
+                bar.update(len(chunk))
+
+        attachments = [(pub_issue, attachment) for sk_issue, pub_issue in migrated
+                       for attachment in sk_issue.fields.attachment or []]
+
+        if attachments:
+            with ThreadPoolExecutor(max_workers=self.ATTACHMENT_WORKERS) as executor:
+                uploads = executor.map(lambda item: self.migrate_attachment(*item), attachments)
+
+                with click.progressbar(uploads, length=len(attachments), label='Migrating attachments') as bar:
+                    for _ in bar:
+                        pass
+
+        for sk_issue, pub_issue in migrated:
+            click.echo('%s -> %s' % (io.highlight_key(issue=sk_issue), io.highlight_key(issue=pub_issue)))
+
+        return [pub_issue for sk_issue, pub_issue in migrated]
+
+    def bulk_fields(self, sk_issue, rules):
+        """
+        Convert SK issue to PUB fields by using bulk rules instead of prompts.
+
+        :param sk_issue:
+        :param rules:
+        :return:
+        """
+        rule = dict(rules.get('default', {}))
+        rule.update(rules.get(sk_issue.fields.project.key, {}))
+
+        summary = rule.get('summary', '{key}: {summary}').format(key=sk_issue.key, summary=sk_issue.fields.summary)
+
+        fields = self.default_fields(sk_issue, summary, rule.get('estimate'))
+        fields['labels'] += [label for label in rule.get('labels', []) if label not in fields['labels']]
+
+        return fields
+
+    @classmethod
+    def read_bulk_rules(cls, path=None):
+        """
+        Reads JSON file with bulk migration rules. Rules of SK project are applied on top of `default` ones:
+
+            {"default": {"estimate": "2h"}, "ULT": {"estimate": "4h", "labels": ["ui"]}}
+
+        Supported keys are `summary` (format with {key} and {summary}), `estimate` and `labels`.
+
+        :param path:
+        :return: dict
+        """
+        if path is None:
+            return {}
+
+        with open(path) as f:
+            return json.load(f)
 
     def create_pub_issue(self, sk_issue):
         """
@@ -93,15 +379,35 @@ class IssueSync(object):
         :param sk_issue:
         :return:
         """
+        fields = self.prepare_fields(sk_issue)
+        if fields is None:
+            return None
+
+        return self._pub_jira.create_issue(fields=fields)
+
+    def prepare_fields(self, sk_issue):
+        """
+        Converts SK issue to PUB fields and asks a user to confirm them.
+
+        :param sk_issue:
+        :return: dict or None if the fields are invalid or not confirmed
+        """
         fields = self.convert_fields(sk_issue)
 
+        try:
+            self._mapping.validate(fields, self.meta)
+        except FieldMappingException as e:
+            io.error(e.message, nl=True)
+
+            return None
+
         click.echo("\nPlease confirm migration:")
         io.print_dict(fields, indent=1)
 
         if not click.confirm('\nMigrate?', default=False):
             return None
 
-        return self._pub_jira.create_issue(fields=fields)
+        return fields
 
     def migrate_attachments(self, sk_issue, pub_issue):
         """
@@ -115,7 +421,13 @@ class IssueSync(object):
             click.echo('Beginning of migration attachments')
 
         for attachment in sk_issue.fields.attachment:
-            self._pub_jira.add_attachment(pub_issue, attachment.get(), filename=attachment.filename)
+            self.migrate_attachment(pub_issue, attachment)
+
+    def migrate_attachment(self, pub_issue, attachment):
+        """
+        Copy one SK attachment to PUB issue.
+        """
+        return self._pub_jira.add_attachment(pub_issue, attachment.get(), filename=attachment.filename)
 
     def convert_fields(self, sk_issue):
         """
@@ -131,81 +443,65 @@ class IssueSync(object):
 
         estimate = io.input_jira_estimate('Original Estimate')
 
+        return self.default_fields(sk_issue, summary, estimate)
+
+    def default_fields(self, sk_issue, summary, estimate=None):
+        """
+        Build PUB fields of SK issue with the given summary and estimate.
+
+        :param sk_issue:
+        :param summary:
+        :param estimate:
+        :return:
+        """
         labels = ['auto_migration']
 
         if sk_issue.fields.project.key == 'ULT':
             labels += ['ultra']
 
-        return {
-            'project': {
-                'id': '41767',  # Sheknows DT project
-                'name': 'SheknowsDT'
-            },
+        fields = {
+            'project': self.meta.project_ref,
             'issuetype': self.convert_issue_type(sk_issue.fields.issuetype),
             'summary': summary,
             'priority': self.convert_priority(sk_issue.fields.priority),
             'description': sk_issue.fields.description if sk_issue.fields.description else summary,
-            'timetracking': {
-                'originalEstimate': estimate
-            },
             'labels': labels,
             'customfield_11470': sk_issue.permalink()
         }
 
-    @classmethod
-    def convert_priority(cls, sk_priority):
+        if estimate:
+            fields['timetracking'] = {
+                'originalEstimate': estimate
+            }
+
+        return fields
+
+    def convert_priority(self, sk_priority):
         """
-        Convert SK issue priority to PUB. You can find all of the by /rest/api/2/priority.
+        Convert SK issue priority to PUB.
 
         :param sk_priority:
         :return:
         """
-        map = {
-            1: {  # Blocker
-                'id': '1',
-                'name': 'Blocker'
-            },
-            2: {  # Critical
-                'id': '2',
-                'name': 'Critical'
-            },
-            3: {  # Major
-                'id': '3',
-                'name': 'Major'
-            },
-            7: {  # Important
-                'id': '3',
-                'name': 'Major'
-            },
-            4: {  # Minor
-                'id': '4',
-                'name': 'Minor'
-            },
-            5: {  # Trivial
-                'id': '5',
-                'name': 'Trivial'
-            },
-        }
-
-        return map.get(int(sk_priority.id), map[4])
+        return self._mapping.priority(sk_priority)
 
-    @classmethod
-    def convert_issue_type(cls, sk_type):
+    def convert_issue_type(self, sk_type):
         """
-        Convert SK issue type to PUB. You can find all types by /rest/api/2/issuetype.
+        Convert SK issue type to PUB.
 
         :param sk_type:
         :return:
         """
-        map = {
-            1: {  # Bug
-                'id': '1',
-                'name': 'Bug',
-            },
-            3: {  # Task
-                'id': '3',
-                'name': 'Task',
-            },
-        }
+        return self._mapping.issue_type(sk_type)
+
+    @property
+    def meta(self):
+        """
+        PUB create metadata, fetched once per run and cached locally.
+
+        :rtype: CreateMeta
+        """
+        if self._meta is None:
+            self._meta = CreateMeta.load(self._pub_jira, self._mapping.project, self._mapping.createmeta_ttl)
 
-        return map.get(int(sk_type.id), map[3])
+        return self._meta
@@ -1,16 +1,45 @@
+import threading
+
 import jira
+from requests.adapters import HTTPAdapter
 
 from src.config import AppConfig
 from src.decorators import except_exception
+from src.http_cache import CachingAdapter, HttpCache
 
 
 class BaseFactory(object):
+    use_cache = True
+
+    # All connections share one adapter, so connection pools are shared between accounts as well.
+    POOL_SIZE = 32
+
+    _adapter = None
+    _adapter_lock = threading.Lock()
+
     @classmethod
     def create_jira(cls, config):
         if not config.valid():
             raise Exception
 
-        return jira.JIRA(config.url, basic_auth=(config.username, config.password), validate=True, max_retries=0)
+        connection = jira.JIRA(config.url, basic_auth=(config.username, config.password), validate=True,
+                               max_retries=0)
+
+        connection._session.mount('https://', cls.adapter())
+        connection._session.mount('http://', cls.adapter())
+
+        return connection
+
+    @classmethod
+    def adapter(cls):
+        with BaseFactory._adapter_lock:
+            if BaseFactory._adapter is None:
+                if cls.use_cache:
+                    BaseFactory._adapter = CachingAdapter(HttpCache(), pool_maxsize=cls.POOL_SIZE)
+                else:
+                    BaseFactory._adapter = HTTPAdapter(pool_maxsize=cls.POOL_SIZE)
+
+        return BaseFactory._adapter
 
 
 class PubFactory(BaseFactory):
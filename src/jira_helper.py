@@ -1,6 +1,13 @@
-from datetime import datetime as dt
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime as dt, timedelta as td
 
 import jira
+from jira.resources import Issue, Worklog
+
+from src.field_mapping import FieldMapping
 
 
 def jira_time_to_dt(jira_time):
@@ -22,30 +29,79 @@ def unique(l):
     return list(set(filter(None, l)))
 
 
+def date_shards(date_start, date_finish, days):
+    """Yield successive (start, finish) windows of n days which cover the whole range."""
+    while date_start <= date_finish:
+        shard_finish = min(date_start + td(days=days - 1), date_finish)
+
+        yield date_start, shard_finish
+
+        date_start = shard_finish + td(days=1)
+
+
 class JiraHelper(object):
     MAX_RESULT = 100000
 
-    def __init__(self, jira):
+    # Searches are sent by POST, so only the length of JQL itself is limited.
+    JQL_LIMIT = 20000
+    SEARCH_PAGE = 1000
+
+    # Search results contain up to 20 worklogs of each issue, usually it's enough to skip worklog requests.
+    SEARCH_FIELDS = '*navigable,worklog'
+
+    WORKLOG_PAGE = 1000
+
+    SHARD_DAYS = 7
+    SEARCH_WORKERS = 4
+
+    def __init__(self, jira, user=None, issue_cache=None, executor=None):
         """
         :type jira: jira.JIRA
+        :param user: author of worklogs, the user of connection by default.
+        :type issue_cache: IssueCache
+        :param executor: bounded executor shared with other helpers. Methods are called by its tasks, so they don't
+        start own threads then and requests are done one by one.
         """
         self.connection = jira
-        self._current_user = jira.current_user()
+        self.current_user = user or jira.current_user()
+        self._author_jql = "'%s'" % user if user else 'currentUser()'
+
+        self._issue_cache = issue_cache
+        self._executor = executor
+
+        # None until the first windowed request, so only a server which never accepted it is switched off.
+        self._worklog_window_supported = None
+
+    def bypass_cache(self):
+        """
+        Requests of the connection go to the server, the local HTTP cache isn't used for them.
+        """
+        self.connection._session.headers['Cache-Control'] = 'no-store'
 
     def merge_issues(self, first_issues, second_issues):
         return {issue.id: issue for issue in first_issues + second_issues}.values()
 
-    def issues_by_worklog_date_range(self, date_start, date_finish):
+    def issues_by_worklog_date_range(self, date_start, date_finish, shard_days=None):
         """
+        Finds issues with worklogs of the current user. Long ranges are split into shards which are searched
+        concurrently.
+
         :type date_start: dt
         :type date_finish: dt
+        :type shard_days: int
 
-        :rtype: ReslutList
+        :rtype: list
         """
+        shards = date_shards(date_start, date_finish, shard_days or self.SHARD_DAYS)
 
-        return self.connection.search_issues(
-            "worklogDate >= '%s' and worklogDate <= '%s' and worklogAuthor=currentUser()" %
-            (date_start.strftime("%Y/%m/%d"), date_finish.strftime("%Y/%m/%d")))
+        results = self._map(lambda shard: self.connection.search_issues(
+            self._worklog_date_jql(*shard), maxResults=self.MAX_RESULT, fields=self.SEARCH_FIELDS), shards)
+
+        return list(OrderedDict((issue.id, issue) for result in results for issue in result).values())
+
+    def _worklog_date_jql(self, date_start, date_finish):
+        return "worklogDate >= '%s' and worklogDate <= '%s' and worklogAuthor=%s" % (
+            date_start.strftime("%Y/%m/%d"), date_finish.strftime("%Y/%m/%d"), self._author_jql)
 
     def remove_worklog(self, issue, worklog):
         """
@@ -54,35 +110,135 @@ class JiraHelper(object):
 
         :rtype: str
         """
-        url = self.connection._get_url(worklog._resource.format(issue.id, worklog.id))
+        self.remove_worklog_by_id(issue.id, worklog.id)
 
-        self.connection._session.delete(url)
+    def remove_worklog_by_id(self, issue_id, worklog_id):
+        """
+        Removes worklog, already removed worklog is not an error.
+        """
+        url = self.connection._get_url('issue/%s/worklog/%s' % (issue_id, worklog_id))
+
+        try:
+            self.connection._session.delete(url)
+        except jira.JIRAError as e:
+            if e.status_code != 404:
+                raise
 
     def remove_worklogs(self, issue, worklogs):
         [self.remove_worklog(issue, worklog) for worklog in worklogs]
 
     def add_worklog(self, issue, worklog):
-        self.connection.add_worklog(issue, timeSpentSeconds=worklog.total_time,
-                                    started=jira_time_to_dt(worklog.started),
-                                    comment=worklog.comment)
+        self.add_worklog_values(issue, worklog.total_time, worklog.started, getattr(worklog, 'comment', None))
+
+    def add_worklog_values(self, issue, seconds, started, comment=None):
+        """
+        :type issue: jira.Issue or str
+        :type seconds: int
+        :param started: JIRA formatted time.
+        :type comment: str
+        """
+        self.connection.add_worklog(issue, timeSpentSeconds=seconds, started=jira_time_to_dt(started),
+                                    comment=comment)
 
     def get_worklogs_by_date(self, issue, date_start, date_finish):
         """
-        :type issues: dict
-        :type date_start: str
-        :type date_finish: str
+        Errors are raised: an issue without its worklogs would look like one without time.
 
-        :rtype: dict
+        :type issue: jira.Issue or str
+        :type date_start: dt
+        :type date_finish: dt
+
+        :rtype: list
         """
-        try:
-            self.connection.async_do()
-            return [worklog for worklog in self.connection.worklogs(issue) if
-                    worklog.author.name == self._current_user and
-                    date_start < jira_time_to_dt(worklog.started) < date_finish]
+        return self._filter_worklogs(self._worklogs_in_window(issue, date_start, date_finish), date_start, date_finish)
 
-        except:
+    def get_embedded_worklogs_by_date(self, issue, date_start, date_finish):
+        """
+        Get worklogs from the `worklog` field of a search result.
+
+        :type issue: jira.Issue
+        :type date_start: dt
+        :type date_finish: dt
+
+        :return: list or None if the search result doesn't contain all worklogs of the issue.
+        """
+        worklog = getattr(issue.fields, 'worklog', None)
+        if worklog is None or worklog.total > len(worklog.worklogs):
             return None
 
+        return self._filter_worklogs(worklog.worklogs, date_start, date_finish)
+
+    def _filter_worklogs(self, worklogs, date_start, date_finish):
+        return [worklog for worklog in worklogs if
+                worklog.author.name == self.current_user and
+                date_start < jira_time_to_dt(worklog.started) < date_finish]
+
+    def _worklogs_in_window(self, issue, date_start, date_finish):
+        """
+        Get worklogs of issue started within the window page by page. Servers which don't support
+        `startedAfter`/`startedBefore` return the full history, so the result still has to be filtered.
+
+        :type issue: jira.Issue or str
+        :type date_start: dt
+        :type date_finish: dt
+
+        :rtype: list
+        """
+        if self._worklog_window_supported is False:
+            return self.connection.worklogs(issue)
+
+        params = {
+            'startedAfter': int(date_start.timestamp() * 1000),
+            'startedBefore': int(date_finish.timestamp() * 1000),
+            'maxResults': self.WORKLOG_PAGE,
+        }
+
+        worklogs = []
+
+        while True:
+            params['startAt'] = len(worklogs)
+
+            try:
+                page = self.connection._get_json('issue/%s/worklog' % getattr(issue, 'id', issue), params=params)
+            except jira.JIRAError as e:
+                if e.status_code != 400 or worklogs:
+                    raise
+
+                if self._worklog_window_supported is None:
+                    self._worklog_window_supported = False
+
+                return self.connection.worklogs(issue)
+
+            self._worklog_window_supported = True
+
+            raw_worklogs = page.get('worklogs', [])
+
+            worklogs += [Worklog(self.connection._options, self.connection._session, raw) for raw in raw_worklogs]
+
+            if not raw_worklogs or len(worklogs) >= page.get('total', 0):
+                return worklogs
+
+    def search_pages(self, jql, page_size=50):
+        """
+        Yields search results page by page, so callers can start working before the whole result set arrives.
+        JQL has to be ordered by a stable field, otherwise issues can move between pages while they are loaded.
+
+        :type jql: str
+        :type page_size: int
+        """
+        start_at = 0
+
+        while True:
+            page = self.connection.search_issues(jql, startAt=start_at, maxResults=page_size, validate_query=False)
+            if not page:
+                return
+
+            yield page
+
+            start_at += len(page)
+            if start_at >= page.total:
+                return
+
     def issues(self, keys):
         """
         Get all issues by keys.
@@ -90,28 +246,133 @@ class JiraHelper(object):
         :param keys:
         :return:
         """
-        issues = []
+        keys = unique(keys)
 
-        for chunk in chunks(unique(keys), 100):
-            jql = "key in ('" + "','".join(chunk) + "')"
+        cached = self._cached('issue', keys)
+        issues = list(cached.values())
 
-            issues += self.connection.search_issues(jql, maxResults=self.MAX_RESULT, validate_query=False)
+        for found in self._search_batches([key for key in keys if key not in cached],
+                                          lambda batch: "key in ('%s')" % "','".join(batch)):
+            self._cache('issue', {issue.key: issue for issue in found})
+            issues += found
 
         return issues
 
+    def search(self, jql):
+        """
+        Finds all issues by POST request, so JQL length is not limited by URL length.
 
-class PubHelper(JiraHelper):
-    def issues_by_worklog_date_range(self, date_start, date_finish):
+        :type jql: str
+
+        :rtype: list
         """
-        :type date_start: dt
-        :type date_finish: dt
+        issues = []
+
+        while True:
+            data = {'jql': jql, 'startAt': len(issues), 'maxResults': self.SEARCH_PAGE,
+                    'fields': self.SEARCH_FIELDS.split(','), 'validateQuery': False}
+
+            page = self.connection._session.post(self.connection._get_url('search'), data=json.dumps(data)).json()
 
-        :rtype: ReslutList
+            issues += [Issue(self.connection._options, self.connection._session, raw) for raw in page['issues']]
+
+            if not page['issues'] or len(issues) >= page['total']:
+                return issues
+
+    def _search_batches(self, values, jql):
         """
+        Splits values into batches which fit JQL limit and searches them concurrently.
+
+        :param values: list of str
+        :param jql: function which builds JQL by batch of values.
+
+        :return: list of search results of batches
+        """
+        batches = []
+        batch = []
+        length = 0
+
+        for value in values:
+            value_length = len(jql([value]))
+
+            if batch and length + value_length > self.JQL_LIMIT:
+                batches.append(batch)
+                batch, length = [], 0
+
+            batch.append(value)
+            length += value_length
+
+        if batch:
+            batches.append(batch)
+
+        if not batches:
+            return []
+
+        return self._map(lambda batch: self.search(jql(batch)), batches)
+
+    def _map(self, fn, items):
+        """
+        Call fn for every item concurrently. With a shared executor items are done one by one: the caller is its task
+        already and a bounded executor must not wait for its own tasks.
+
+        :rtype: list
+        """
+        items = list(items)
+
+        if self._executor is not None or len(items) < 2:
+            return [fn(item) for item in items]
+
+        with ThreadPoolExecutor(max_workers=self.SEARCH_WORKERS) as executor:
+            return list(executor.map(fn, items))
 
-        return self.connection.search_issues(
-            "worklogDate >= '%s' and worklogDate <= '%s' and worklogAuthor=currentUser()  and project = SheknowsDT" %
-            (date_start.strftime("%Y/%m/%d"), date_finish.strftime("%Y/%m/%d")))
+    def _cached(self, namespace, keys):
+        if self._issue_cache is None:
+            return {}
+
+        return self._issue_cache.get_many(self.connection._options['server'], namespace, keys)
+
+    def _cache(self, namespace, items):
+        if self._issue_cache is not None:
+            self._issue_cache.put_many(self.connection._options['server'], namespace, items)
+
+
+class IssueCache(object):
+    """
+    Thread-safe in-memory cache of issues which can be shared between helpers of several accounts.
+    """
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, server, namespace, keys):
+        with self._lock:
+            return {key: self._items[(server, namespace, key)] for key in keys if
+                    (server, namespace, key) in self._items}
+
+    def put_many(self, server, namespace, items):
+        with self._lock:
+            self._items.update({(server, namespace, key): value for key, value in items.items()})
+
+
+class PubHelper(JiraHelper):
+    # Types of SK link field whose values are plain URLs which can be searched by `in`.
+    EXACT_FIELD_TYPES = (
+        'com.atlassian.jira.plugin.system.customfieldtypes:url',
+    )
+
+    def __init__(self, jira, user=None, issue_cache=None, executor=None, project=None):
+        """
+        :param project: PUB project key, the one of field mapping by default.
+        """
+        super().__init__(jira, user, issue_cache, executor)
+
+        self.project = project or FieldMapping.from_config().project
+
+        self._sk_link_exact = None
+
+    def _worklog_date_jql(self, date_start, date_finish):
+        return super()._worklog_date_jql(date_start, date_finish) + " and project = '%s'" % self.project
 
     def get_issues_by_sk_links(self, links):
         """
@@ -121,11 +382,37 @@ class PubHelper(JiraHelper):
 
         :return:
         """
-        pub_issues = []
+        links = unique(links)
+
+        cached = self._cached('sk_link', links)
+        pub_issues = [issue for issues in cached.values() for issue in issues]
+
+        links = [link for link in links if link not in cached]
+
+        if self._is_sk_link_exact():
+            jql = lambda batch: "cf[11470] in ('%s')" % "','".join(batch)
+        else:
+            jql = lambda batch: "'External issue ID' ~ '" + "' OR 'External issue ID' ~ '".join(batch) + "'"
 
-        for chunk in chunks(unique(links), 40):
-            jql = "'External issue ID' ~ '" + "' OR 'External issue ID' ~ '".join(chunk) + "'"
+        by_link = {link: [] for link in links}
 
-            pub_issues += self.connection.search_issues(jql, maxResults=self.MAX_RESULT, validate_query=False)
+        for found in self._search_batches(links, jql):
+            for issue in found:
+                by_link.setdefault(getattr(issue.fields, 'customfield_11470', None), []).append(issue)
+
+            pub_issues += found
+
+        self._cache('sk_link', by_link)
 
         return pub_issues
+
+    def _is_sk_link_exact(self):
+        """
+        Checks if the field of SK link can be searched by exact values, text fields support only `~`.
+        """
+        if self._sk_link_exact is None:
+            field = next((field for field in self.connection.fields() if field['id'] == 'customfield_11470'), {})
+
+            self._sk_link_exact = field.get('schema', {}).get('custom') in self.EXACT_FIELD_TYPES
+
+        return self._sk_link_exact
@@ -0,0 +1,108 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+from src.config import AppConfig
+
+
+class Journal(object):
+    """
+    Write-ahead journal of worklog synchronization, stored as JSON lines in the app dir.
+
+    Every synchronization of SK issue for a day is a plan with worklogs to remove and to add. The plan is written
+    before any change, then every finished operation and the commit of the plan. Plans without commit can be
+    resumed, the whole file is an audit log of changes. A new plan for the same user, issue and day supersedes
+    unfinished ones, so they are never resumed on top of it.
+    """
+    FILE_NAME = 'journal.jsonl'
+
+    _lock = threading.Lock()
+
+    def __init__(self, path=None):
+        self._path = path or AppConfig.get_app_file_path(self.FILE_NAME)
+
+        # (user, issue id, date) of unfinished plans by id, it's read from the file on the first plan.
+        self._open_plans = None
+
+    def plan(self, user, issue_id, issue_key, date, remove, add):
+        """
+        :param user: SK user who does changes.
+        :param remove: ids of SK worklogs.
+        :param add: list of dicts with `seconds`, `started` and `comment` of new SK worklogs.
+
+        :return: plan dict
+        """
+        plan = {'op': 'plan', 'id': uuid.uuid4().hex, 'user': user, 'issue_id': issue_id, 'issue_key': issue_key,
+                'date': date.strftime('%Y-%m-%d'), 'remove': remove, 'add': add}
+
+        if self._open_plans is None:
+            self._open_plans = {old['id']: self._slice(old) for old in self.unfinished()}
+
+        for old_id in [old_id for old_id, old_slice in self._open_plans.items() if old_slice == self._slice(plan)]:
+            self._write({'op': 'superseded', 'id': old_id, 'by': plan['id']})
+            del self._open_plans[old_id]
+
+        self._write(plan)
+        self._open_plans[plan['id']] = self._slice(plan)
+
+        plan['done'] = []
+
+        return plan
+
+    def done(self, plan, action, item):
+        """
+        :param action: `remove` or `add`.
+        :param item: id of removed worklog or index of added one.
+        """
+        self._write({'op': 'done', 'id': plan['id'], 'action': action, 'item': item})
+
+        plan['done'].append([action, item])
+
+    def commit(self, plan):
+        self._write({'op': 'commit', 'id': plan['id']})
+
+        if self._open_plans is not None:
+            self._open_plans.pop(plan['id'], None)
+
+    def unfinished(self):
+        """
+        Get plans which were started but not committed.
+
+        :rtype: list
+        """
+        if not os.path.isfile(self._path):
+            return []
+
+        plans = {}
+
+        with open(self._path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # The last line can be broken if the process was killed while writing.
+                    continue
+
+                if entry['op'] == 'plan':
+                    entry['done'] = []
+                    plans[entry['id']] = entry
+                elif entry['op'] == 'done' and entry['id'] in plans:
+                    plans[entry['id']]['done'].append([entry['action'], entry['item']])
+                elif entry['op'] in ('commit', 'superseded'):
+                    plans.pop(entry['id'], None)
+
+        return sorted(plans.values(), key=lambda plan: plan['time'])
+
+    @classmethod
+    def _slice(cls, plan):
+        return plan['user'], str(plan['issue_id']), plan['date']
+
+    def _write(self, entry):
+        entry['time'] = time.time()
+
+        with self._lock, open(self._path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
@@ -0,0 +1,163 @@
+import csv
+import json
+from array import array
+from collections import Counter
+from datetime import datetime as dt
+
+
+class WorklogReport(object):
+    """
+    Columnar storage of SK and PUB worklogs with group-by aggregations.
+
+    Every worklog is a row of parallel arrays, strings (keys, projects) are stored once in a string table.
+    """
+    SK = 0
+    PUB = 1
+
+    INSTANCES = ('sk', 'pub')
+
+    GROUPS = ('day', 'issue', 'project', 'key')
+
+    # Time zone offsets are multiples of 15 minutes, so all timestamps of a bucket are on the same local day.
+    DAY_BUCKET = 15 * 60
+
+    def __init__(self):
+        self._strings = []
+        self._string_ids = {}
+
+        self.instance = array('b')
+        self.started = array('d')
+        self.seconds = array('l')
+        self.issue = array('l')
+        self.project = array('l')
+        self.sk_key = array('l')
+
+    @classmethod
+    def from_collections(cls, sk_collection, pub_collection):
+        """
+        :type sk_collection: src.jira_container.IssuesCollection
+        :type pub_collection: src.jira_container.PubIssuesCollection
+
+        :rtype: WorklogReport
+        """
+        report = cls()
+
+        for issue in sk_collection:
+            report._add_issue(cls.SK, issue, issue.key)
+
+        for issue in pub_collection:
+            report._add_issue(cls.PUB, issue, issue.sk_key)
+
+        return report
+
+    def __len__(self):
+        return len(self.seconds)
+
+    def by_day(self):
+        """
+        Total time per day for both JIRAs and the difference PUB - SK.
+        """
+        days = self._days()
+        totals = self._sum(zip(days, self.instance))
+
+        return [{'day': day, 'sk': totals[(day, self.SK)], 'pub': totals[(day, self.PUB)],
+                 'delta': totals[(day, self.PUB)] - totals[(day, self.SK)]} for day in sorted(set(days))]
+
+    def by_issue(self):
+        """
+        Total time per issue.
+        """
+        totals = self._sum(zip(self.instance, self.issue))
+
+        return [{'instance': self.INSTANCES[instance], 'issue': self._strings[issue], 'seconds': seconds}
+                for (instance, issue), seconds in sorted(totals.items())]
+
+    def by_project(self):
+        """
+        Total time per project.
+        """
+        totals = self._sum(zip(self.instance, self.project))
+
+        return [{'instance': self.INSTANCES[instance], 'project': self._strings[project], 'seconds': seconds}
+                for (instance, project), seconds in sorted(totals.items())]
+
+    def by_key(self):
+        """
+        Total time per SK key for both JIRAs and the difference PUB - SK.
+        """
+        totals = self._sum(zip(self.sk_key, self.instance))
+        keys = sorted(set(key for key, instance in totals), key=lambda key: self._string(key))
+
+        return [{'key': self._string(key), 'sk': totals[(key, self.SK)], 'pub': totals[(key, self.PUB)],
+                 'delta': totals[(key, self.PUB)] - totals[(key, self.SK)]} for key in keys]
+
+    def rows(self, group):
+        return getattr(self, 'by_' + group)()
+
+    def write(self, stream, group, output_format='csv'):
+        """
+        Write aggregated rows of the group as CSV or JSON.
+        """
+        rows = self.rows(group)
+
+        if output_format == 'json':
+            json.dump(rows, stream, indent=2)
+            stream.write('\n')
+
+            return
+
+        if not rows:
+            return
+
+        writer = csv.DictWriter(stream, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+    def _add_issue(self, instance, issue, sk_key):
+        issue_id = self._intern(issue.key)
+        project_id = self._intern(issue.fields.project.key)
+        sk_key_id = self._intern(sk_key) if sk_key else -1
+
+        for worklog in issue.worklogs:
+            self.instance.append(instance)
+            self.started.append(worklog.time_started)
+            self.seconds.append(worklog.total_time)
+            self.issue.append(issue_id)
+            self.project.append(project_id)
+            self.sk_key.append(sk_key_id)
+
+    def _intern(self, string):
+        string_id = self._string_ids.get(string)
+        if string_id is None:
+            string_id = self._string_ids[string] = len(self._strings)
+            self._strings.append(string)
+
+        return string_id
+
+    def _string(self, string_id):
+        return self._strings[string_id] if string_id >= 0 else ''
+
+    def _days(self):
+        """
+        Local date of each row. Timestamps are converted to dates once per bucket.
+        """
+        cache = {}
+        days = []
+
+        for started in self.started:
+            bucket = int(started) // self.DAY_BUCKET
+            day = cache.get(bucket)
+            if day is None:
+                day = cache[bucket] = dt.fromtimestamp(bucket * self.DAY_BUCKET).strftime('%Y-%m-%d')
+
+            days.append(day)
+
+        return days
+
+    def _sum(self, groups):
+        totals = Counter()
+
+        for group, seconds in zip(groups, self.seconds):
+            totals[group] += seconds
+
+        return totals
@@ -0,0 +1,258 @@
+import json
+import mmap
+import struct
+import sys
+from array import array
+from datetime import datetime as dt, timezone
+from types import SimpleNamespace
+
+from src.jira_container import Issue, IssuesCollection, PubIssue, PubIssuesCollection
+
+
+class SnapshotIssue(object):
+    """
+    Issue restored from snapshot. It has only attributes which are used by time synchronization.
+    """
+
+    def __init__(self, id, key, link, summary, project, sk_url=None):
+        self.id = id
+        self.key = key
+        self.fields = SimpleNamespace(summary=summary, project=SimpleNamespace(key=project), customfield_11470=sk_url)
+
+        self._link = link
+
+    def permalink(self):
+        return self._link
+
+
+class Snapshot(object):
+    """
+    SK and PUB issues with worklogs of a time synchronization window, stored in a compact binary file.
+
+    Issues and worklogs are rows of parallel arrays, strings (keys, links, comments, dates) are stored once in a
+    string table. The file is a magic line, JSON header with positions of columns and the columns themselves, so it
+    is read through mmap without parsing:
+
+        MAGIC | header length (uint32) | JSON header | padding | column | padding | column ...
+    """
+    MAGIC = b'JPSNAP1\n'
+
+    SK = 0
+    PUB = 1
+
+    # Columns are stored little-endian and aligned, so they can be cast from mmap directly.
+    ALIGN = 8
+
+    COLUMNS = (
+        ('issue_instance', 'b'),
+        ('issue_id', 'i'),
+        ('issue_key', 'i'),
+        ('issue_link', 'i'),
+        ('issue_summary', 'i'),
+        ('issue_project', 'i'),
+        ('issue_sk_url', 'i'),
+        # Worklogs of issue N are rows issue_worklogs[N]..issue_worklogs[N + 1] of worklog columns.
+        ('issue_worklogs', 'q'),
+        ('worklog_id', 'i'),
+        ('worklog_started', 'i'),
+        ('worklog_seconds', 'q'),
+        ('worklog_comment', 'i'),
+        ('worklog_updated', 'i'),
+        ('worklog_author', 'i'),
+        # String N is bytes string_offsets[N]..string_offsets[N + 1] of strings.
+        ('string_offsets', 'q'),
+        ('strings', 'B'),
+    )
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views = []
+
+        if self._mmap[:len(self.MAGIC)] != self.MAGIC:
+            self.close()
+            raise ValueError('%s is not a snapshot file' % path)
+
+        header_start = len(self.MAGIC) + 4
+        header_length = struct.unpack('<I', self._mmap[len(self.MAGIC):header_start])[0]
+        self._header = json.loads(self._mmap[header_start:header_start + header_length].decode('utf-8'))
+        self._data_start = self._align(header_start + header_length)
+
+        self.date_start = dt.fromtimestamp(self._header['start'], tz=timezone.utc).astimezone()
+        self.date_finish = dt.fromtimestamp(self._header['finish'], tz=timezone.utc).astimezone()
+        self.sk_user = self._header['sk_user']
+        self.pub_user = self._header['pub_user']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        [view.release() for view in reversed(self._views)]
+        self._views = []
+
+        self._mmap.close()
+        self._file.close()
+
+    @classmethod
+    def write(cls, path, sk_collection, pub_collection, date_start, date_finish, sk_user, pub_user):
+        """
+        :type sk_collection: src.jira_container.IssuesCollection
+        :type pub_collection: src.jira_container.PubIssuesCollection
+        :type date_start: dt
+        :type date_finish: dt
+        :param sk_user: author of SK worklogs.
+        :param pub_user: author of PUB worklogs.
+
+        :return: number of stored worklogs.
+        """
+        columns = {name: array(typecode) for name, typecode in cls.COLUMNS}
+        strings = {}
+
+        def intern(string):
+            if string is None:
+                return -1
+
+            string_id = strings.get(string)
+            if string_id is None:
+                string_id = strings[string] = len(strings)
+
+            return string_id
+
+        columns['issue_worklogs'].append(0)
+
+        for instance, collection in ((cls.SK, sk_collection), (cls.PUB, pub_collection)):
+            for issue in collection:
+                columns['issue_instance'].append(instance)
+                columns['issue_id'].append(intern(str(issue.id)))
+                columns['issue_key'].append(intern(issue.key))
+                columns['issue_link'].append(intern(issue.link))
+                columns['issue_summary'].append(intern(issue.fields.summary))
+                columns['issue_project'].append(intern(issue.fields.project.key))
+                columns['issue_sk_url'].append(intern(issue.sk_url if instance == cls.PUB else None))
+
+                for worklog in issue.worklogs:
+                    columns['worklog_id'].append(intern(str(worklog.id)))
+                    columns['worklog_started'].append(intern(worklog.started))
+                    columns['worklog_seconds'].append(worklog.total_time)
+                    columns['worklog_comment'].append(intern(getattr(worklog, 'comment', None)))
+                    columns['worklog_updated'].append(intern(getattr(worklog, 'updated', None)))
+                    columns['worklog_author'].append(intern(worklog.author.name))
+
+                columns['issue_worklogs'].append(len(columns['worklog_id']))
+
+        columns['string_offsets'].append(0)
+        for string in strings:
+            encoded = string.encode('utf-8')
+            columns['strings'].frombytes(encoded)
+            columns['string_offsets'].append(len(columns['strings']))
+
+        if sys.byteorder != 'little':
+            [column.byteswap() for column in columns.values()]
+
+        positions = {}
+        offset = 0
+        for name, typecode in cls.COLUMNS:
+            positions[name] = [typecode, offset, len(columns[name])]
+            offset = cls._align(offset + len(columns[name]) * columns[name].itemsize)
+
+        header = json.dumps({
+            'start': date_start.timestamp(),
+            'finish': date_finish.timestamp(),
+            'sk_user': sk_user,
+            'pub_user': pub_user,
+            'columns': positions,
+        }).encode('utf-8')
+
+        with open(path, 'wb') as f:
+            f.write(cls.MAGIC)
+            f.write(struct.pack('<I', len(header)))
+            f.write(header)
+            cls._pad(f)
+
+            for name, typecode in cls.COLUMNS:
+                columns[name].tofile(f)
+                cls._pad(f)
+
+        return len(columns['worklog_id'])
+
+    def collections(self):
+        """
+        Restore issues with worklogs.
+
+        :rtype: (IssuesCollection, PubIssuesCollection)
+        """
+        string = self._string_reader()
+
+        instance, issue_worklogs = self._column('issue_instance'), self._column('issue_worklogs')
+        issue_columns = [self._column(name) for name in
+                         ('issue_id', 'issue_key', 'issue_link', 'issue_summary', 'issue_project', 'issue_sk_url')]
+
+        worklog_id, worklog_started, worklog_seconds, worklog_comment, worklog_updated, worklog_author = [
+            self._column(name) for name in ('worklog_id', 'worklog_started', 'worklog_seconds', 'worklog_comment',
+                                            'worklog_updated', 'worklog_author')]
+
+        sk_issues, pub_issues = [], []
+
+        for row in range(len(instance)):
+            issue = SnapshotIssue(*[string(column[row]) for column in issue_columns])
+
+            worklogs = [SimpleNamespace(id=string(worklog_id[n]), started=string(worklog_started[n]),
+                                        timeSpentSeconds=worklog_seconds[n], comment=string(worklog_comment[n]),
+                                        updated=string(worklog_updated[n]),
+                                        author=SimpleNamespace(name=string(worklog_author[n])))
+                        for n in range(issue_worklogs[row], issue_worklogs[row + 1])]
+
+            if instance[row] == self.SK:
+                sk_issues.append(Issue(issue, worklogs))
+            else:
+                pub_issues.append(PubIssue(issue, worklogs))
+
+        return IssuesCollection(sk_issues), PubIssuesCollection(pub_issues)
+
+    def _string_reader(self):
+        offsets, strings = self._column('string_offsets'), self._column('strings')
+        cache = {}
+
+        def string(string_id):
+            if string_id < 0:
+                return None
+
+            value = cache.get(string_id)
+            if value is None:
+                value = cache[string_id] = bytes(strings[offsets[string_id]:offsets[string_id + 1]]).decode('utf-8')
+
+            return value
+
+        return string
+
+    def _column(self, name):
+        """
+        :rtype: memoryview or array
+        """
+        typecode, offset, length = self._header['columns'][name]
+
+        start = self._data_start + offset
+        view = memoryview(self._mmap)[start:start + length * array(typecode).itemsize]
+        self._views.append(view)
+
+        if sys.byteorder == 'little':
+            column = view.cast(typecode)
+            self._views.append(column)
+
+            return column
+
+        column = array(typecode, view.tobytes())
+        column.byteswap()
+
+        return column
+
+    @classmethod
+    def _align(cls, offset):
+        return (offset + cls.ALIGN - 1) // cls.ALIGN * cls.ALIGN
+
+    @classmethod
+    def _pad(cls, f):
+        f.write(b'\0' * (cls._align(f.tell()) - f.tell()))
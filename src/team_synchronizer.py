@@ -0,0 +1,92 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+from src.config import AppConfig
+from src.io import IO as io
+from src.jira_factory import BaseFactory
+from src.jira_helper import IssueCache
+from src.time_synchronizer import TimeSynchronizer
+
+
+class TeamSynchronizer(object):
+    """
+    Time synchronization for several team profiles in one process.
+
+    Requests of all profiles go through one bounded executor and share connection pools and found issues.
+    """
+    WORKERS = 8
+
+    def __init__(self, profiles, workers=WORKERS, shard_days=None, coalesce=False):
+        """
+        :type profiles: list
+        :param profiles: names of team profiles.
+        :param coalesce: write one SK worklog per SK key and day.
+        """
+        self._profiles = profiles
+        self._workers = workers
+        self._shard_days = shard_days
+        self._coalesce = coalesce
+
+    def do(self, date_start, apply=False):
+        """
+        Find differences for every profile, sync them if needed and print summary.
+
+        :type date_start: datetime.datetime
+        :type apply: bool
+        """
+        issue_cache = IssueCache()
+        results = {}
+
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            # Profile runners only wait for requests, all requests themselves are done by the shared executor.
+            with ThreadPoolExecutor(max_workers=len(self._profiles)) as runners:
+                futures = [(name, runners.submit(self._reconcile, name, date_start, apply, issue_cache, executor))
+                           for name in self._profiles]
+
+                with click.progressbar(futures, label='Synchronizing profiles') as bar:
+                    for name, future in bar:
+                        try:
+                            results[name] = future.result()
+                        except Exception as e:
+                            results[name] = e
+
+        self._print_summary(results, apply)
+
+        return results
+
+    def _reconcile(self, name, date_start, apply, issue_cache, executor):
+        # Runners only wait, even connections are validated by the shared executor.
+        synchronizer = executor.submit(self._synchronizer, name, issue_cache, executor, apply).result()
+
+        return synchronizer.reconcile(date_start, apply=apply)
+
+    def _synchronizer(self, name, issue_cache, executor, apply):
+        sk_config, pub_config = AppConfig.read_profile(name)
+        sk_jira, pub_jira = BaseFactory.create_jira(sk_config), BaseFactory.create_jira(pub_config)
+
+        # SK worklogs are written by the login user, worklogs of another author would never match them.
+        if apply and sk_config.author and sk_config.author != sk_jira.current_user():
+            raise Exception('SK author %s isn\'t the login user, it can be only compared' % sk_config.author)
+
+        return TimeSynchronizer(sk_jira, pub_jira, shard_days=self._shard_days, sk_user=sk_config.author,
+                                pub_user=pub_config.author, issue_cache=issue_cache, executor=executor,
+                                quiet=True, coalesce=self._coalesce)
+
+    def _print_summary(self, results, apply):
+        click.echo()
+
+        for name in self._profiles:
+            result = results[name]
+
+            if isinstance(result, Exception):
+                io.error('%s: %s' % (name.ljust(20), result))
+                continue
+
+            line = '%s days: %-4d keys: %-4d %s' % (name.ljust(20), result['days'], result['keys'],
+                                                   io.highlight_time(result['diff'], prefix='[ ', suffix=' ]',
+                                                                     ljust=8))
+            if apply:
+                line += ' synchronized: %d' % result['synced']
+
+            click.echo(line)
@@ -1,10 +1,16 @@
-from datetime import timedelta, datetime as dt
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from datetime import timedelta, datetime as dt, timezone
 
 import click
 
+from src.fingerprints import Fingerprints
 from src.io import IO as io
 from src.jira_container import IssuesCollection, PubIssuesCollection, WorklogsCollection
-from src.jira_helper import JiraHelper, PubHelper
+from src.jira_helper import JiraHelper, PubHelper, date_shards, jira_time_to_dt
+from src.journal import Journal
+from src.snapshot import Snapshot
 
 
 def date_range(start, end):
@@ -14,8 +20,50 @@ def date_range(start, end):
         yield start + timedelta(n)
 
 
+def then(executor, future, fn):
+    """
+    Submit fn with the result of future as soon as it's done. Nothing is blocked while waiting, so it's safe for
+    bounded executors.
+
+    :rtype: Future
+    """
+    result = Future()
+
+    def copy(done):
+        if done.exception() is not None:
+            result.set_exception(done.exception())
+        else:
+            result.set_result(done.result())
+
+    def submit(done):
+        if done.exception() is not None:
+            result.set_exception(done.exception())
+            return
+
+        executor.submit(fn, done.result()).add_done_callback(copy)
+
+    future.add_done_callback(submit)
+
+    return result
+
+
+def day_windows(start, end, days=None):
+    """
+    Split the window into windows of n days, each one ends with the last second of its day.
+    """
+    if not days:
+        yield start, end
+        return
+
+    for window_start, window_finish in date_shards(start, end, days):
+        yield window_start, window_finish.replace(hour=23, minute=59, second=59)
+
+
 class TimeSynchronizer(object):
-    def __init__(self, sk_jira, pub_jira):
+    FETCH_WORKERS = 8
+
+    def __init__(self, sk_jira, pub_jira, shard_days=None, sk_user=None, pub_user=None, issue_cache=None,
+                 executor=None, quiet=False, coalesce=False):
         """
         :type _pub_helper: JiraHelper
         :param pub_jira:
@@ -23,52 +71,308 @@ class TimeSynchronizer(object):
         :type _sk_helper: JiraHelper
         :param sk_jira:
 
+        :param shard_days: size of date windows for issues search.
+        :param sk_user: author of SK worklogs, the user of sk_jira by default.
+        :param pub_user: author of PUB worklogs, the user of pub_jira by default.
+        :param issue_cache: IssueCache shared with other synchronizers.
+        :param executor: executor shared with other synchronizers, own one is used by default.
+        :param quiet: don't print progress.
+        :param coalesce: write one SK worklog per SK key and day instead of copying every PUB worklog.
+
+        In records mode (IO.records) differences are printed as JSON lines and nothing is synchronized.
         """
         self._pub_jira = pub_jira
         self._sk_jira = sk_jira
 
-        self._pub_helper = PubHelper(pub_jira)
-        self._sk_helper = JiraHelper(sk_jira)
+        self._shard_days = shard_days
+        self._executor = executor
+        self._quiet = quiet or io.records
+        self._coalesce = coalesce
+
+        self._pub_helper = PubHelper(pub_jira, user=pub_user, issue_cache=issue_cache, executor=executor)
+        self._sk_helper = JiraHelper(sk_jira, user=sk_user, issue_cache=issue_cache, executor=executor)
 
-    def do(self, date_start):
+        self._journal = Journal()
+
+    def do(self, date_start, chunk_days=None, full=False):
         """
         Find and sync differences between JIRAs
 
         :type date_start: dt
         :param date_start:
 
+        :type chunk_days: int
+        :param chunk_days: process the window by chunks of days. Each chunk is fetched, synchronized and released
+        before the next one, so memory doesn't depend on the window length.
+
+        :type full: bool
+        :param full: show all tasks, even if they haven't changed since the last synchronized run.
         """
-        date_start = date_start.replace(hour=0, minute=0, second=0, microsecond=0)
-        date_finish = dt.today().replace(tzinfo=date_start.tzinfo, hour=23, minute=59, second=59)
+        if not io.records:
+            self._bypass_cache()
+
+        date_start, date_finish = self.window(date_start)
+
+        fingerprints = Fingerprints()
+        unchanged_days = 0
+
+        for chunk_start, chunk_finish in day_windows(date_start, date_finish, chunk_days):
+            sk, pub = self._get_issues_collections(chunk_start, chunk_finish)
+
+            unchanged_days += self._sync_days(sk, pub, chunk_start, chunk_finish, fingerprints, full)
+
+            fingerprints.save()
+
+        if unchanged_days:
+            io.info('Days without changes since the last run: %d' % unchanged_days, nl=True)
+
+    def reconcile(self, date_start, apply=False):
+        """
+        Find differences between JIRAs without any prompts and optionally sync them.
+
+        :type date_start: dt
+        :type apply: bool
+
+        :return: dict with number of days and keys with differences, total difference and synchronized keys.
+        """
+        if apply:
+            self._bypass_cache()
+
+        date_start, date_finish = self.window(date_start)
 
         sk, pub = self._get_issues_collections(date_start, date_finish)
 
+        summary = {'days': 0, 'keys': 0, 'diff': 0, 'synced': 0}
+
         for date in date_range(date_start, date_finish):
-            io.echo_date(date)
+            worklogs_diff = [(sk_issue, pub_collection, date) for time_diff, sk_key, sk_issue, pub_collection in
+                             self._diff_day(sk, pub, date) if time_diff != 0 and sk_issue]
+            if not worklogs_diff:
+                continue
 
-            sk_keys = sk.filter_by_worklog_date(date).keys
-            sk_keys += pub.filter_by_worklog_date(date).sk_keys
+            summary['days'] += 1
+            summary['keys'] += len(worklogs_diff)
+            summary['diff'] += sum(pub_collection.total_worklogs_time(date) -
+                                   sk_issue.worklogs.filter_by_date(date).total_time
+                                   for sk_issue, pub_collection, date in worklogs_diff)
 
-            sk_keys = list(set(sk_keys))
+            if apply:
+                self._run(self._sync_time, worklogs_diff).result()
+                summary['synced'] += len(worklogs_diff)
 
-            worklogs_diff = []
+        return summary
+
+    def _sync_days(self, sk, pub, date_start, date_finish, fingerprints, full=False):
+        """
+        Find and sync differences between collections day by day.
+
+        Tasks without time differences whose worklogs have the same fingerprints as on the last run are not shown.
+
+        :type sk: IssuesCollection
+        :type pub: PubIssuesCollection
+        :type fingerprints: Fingerprints
+
+        :return: number of days without changes.
+        """
+        unchanged_days = 0
+
+        for date in date_range(date_start, date_finish):
+            if io.records:
+                [self._print_record(date, *item) for item in self._diff_day(sk, pub, date)]
+                continue
 
-            for sk_key in sk_keys:
-                sk_issue = sk.get(sk_key)
-                sk_worklogs = sk_issue.worklogs.filter_by_date(date) if sk_issue else WorklogsCollection()
+            lines = []
+            unchanged = 0
 
-                pub_collection = pub.filter_by_sk_key(sk_key).filter_by_worklog_date(date)
+            for time_diff, sk_key, sk_issue, pub_collection in self._diff_day(sk, pub, date):
+                sk_worklogs = sk_issue.worklogs.filter_by_date(date) if sk_issue else []
+                pub_worklogs = [worklog for issue in pub_collection for worklog in issue.worklogs.filter_by_date(date)]
 
-                time_diff = pub_collection.total_worklogs_time(date) - sk_worklogs.total_time
+                fingerprint = Fingerprints.of(sk_worklogs, pub_worklogs)
 
+                if time_diff == 0:
+                    if not full and fingerprints.matches(sk_key, date, fingerprint):
+                        unchanged += 1
+                        continue
+
+                    fingerprints.set(sk_key, date, fingerprint)
+
+                lines.append((time_diff, sk_issue, pub_collection))
+
+            if not lines:
+                unchanged_days += 1 if unchanged else 0
+                continue
+
+            io.echo_date(date)
+
+            worklogs_diff = []
+
+            for time_diff, sk_issue, pub_collection in lines:
                 if time_diff != 0 and sk_issue:
                     worklogs_diff.append((sk_issue, pub_collection, date))
 
                 self._print_line(time_diff, sk_issue, pub_collection)
 
+            if unchanged:
+                click.echo('... and %d tasks without changes' % unchanged)
+
             if worklogs_diff and self._confirm(worklogs_diff):
                 self._sync_time(worklogs_diff)
 
+        return unchanged_days
+
+    def _diff_day(self, sk, pub, date):
+        """
+        Get time differences of SK keys for the day.
+
+        :type sk: IssuesCollection
+        :type pub: PubIssuesCollection
+
+        :return: list of (time difference, SK key, SK issue or None, PUB collection)
+        """
+        sk_keys = sk.filter_by_worklog_date(date).keys
+        sk_keys += pub.filter_by_worklog_date(date).sk_keys
+
+        sk_keys = list(set(sk_keys))
+
+        result = []
+
+        for sk_key in sk_keys:
+            sk_issue = sk.get(sk_key)
+            sk_worklogs = sk_issue.worklogs.filter_by_date(date) if sk_issue else WorklogsCollection()
+
+            pub_collection = pub.filter_by_sk_key(sk_key).filter_by_worklog_date(date)
+
+            time_diff = pub_collection.total_worklogs_time(date) - sk_worklogs.total_time
+
+            result.append((time_diff, sk_key, sk_issue, pub_collection))
+
+        return result
+
+    def _bypass_cache(self):
+        """
+        Found worklogs are going to be changed, so they must not be served by the local HTTP cache.
+        """
+        self._sk_helper.bypass_cache()
+        self._pub_helper.bypass_cache()
+
+    def _run(self, fn, *args):
+        """
+        Run fn on the shared executor or right away if there is no one.
+
+        :rtype: Future
+        """
+        if self._executor is not None:
+            return self._executor.submit(fn, *args)
+
+        future = Future()
+        future.set_result(fn(*args))
+
+        return future
+
+    @classmethod
+    def window(cls, date_start):
+        """
+        Get the first and the last second of synchronization window which ends today.
+
+        :type date_start: dt
+        """
+        date_start = date_start.replace(hour=0, minute=0, second=0, microsecond=0)
+        date_finish = dt.today().replace(tzinfo=date_start.tzinfo, hour=23, minute=59, second=59)
+
+        return date_start, date_finish
+
+    def fetch(self, date_start):
+        """
+        Get issues with worklogs of both JIRAs from date_start till today.
+
+        :type date_start: dt
+
+        :rtype: (IssuesCollection, PubIssuesCollection)
+        """
+        return self._get_issues_collections(*self.window(date_start))
+
+    def snapshot(self, date_start, path):
+        """
+        Fetch issues with worklogs of both JIRAs from date_start till today and store them into the snapshot file.
+
+        :type date_start: dt
+
+        :return: number of stored worklogs.
+        """
+        date_start, date_finish = self.window(date_start)
+
+        sk, pub = self._get_issues_collections(date_start, date_finish)
+
+        return Snapshot.write(path, sk, pub, date_start, date_finish, self._sk_helper.current_user,
+                              self._pub_helper.current_user)
+
+    def replay(self, snapshot):
+        """
+        Print all differences of the snapshot window. Nothing is requested or synchronized.
+
+        :type snapshot: Snapshot
+
+        :return: number of SK keys and days with differences.
+        """
+        sk, pub = snapshot.collections()
+
+        differences = 0
+
+        for date in date_range(snapshot.date_start, snapshot.date_finish):
+            items = sorted(self._diff_day(sk, pub, date), key=lambda item: item[1] or '')
+
+            differences += len([item for item in items if item[0] != 0])
+
+            if io.records:
+                [self._print_record(date, *item) for item in items]
+                continue
+
+            if not items:
+                continue
+
+            io.echo_date(date)
+
+            [self._print_line(time_diff, sk_issue, pub_collection) for time_diff, sk_key, sk_issue, pub_collection in
+             items]
+
+        return differences
+
+    def sync_slice(self, sk_key, date):
+        """
+        Find and sync differences of one SK issue for one day without prompts.
+
+        :type sk_key: str
+        :type date: dt
+
+        :return: time difference before synchronization or None if SK issue is not found.
+        """
+        self._bypass_cache()
+
+        date_start = date.replace(hour=0, minute=0, second=0, microsecond=0)
+        date_finish = date.replace(hour=23, minute=59, second=59)
+
+        sk = IssuesCollection(self._sk_helper.issues([sk_key]))
+        sk_issue = sk.get(sk_key)
+        if sk_issue is None:
+            return None
+
+        pub = PubIssuesCollection(self._pub_helper.get_issues_by_sk_links([sk_issue.link]))
+
+        for helper, collection in ((self._sk_helper, sk), (self._pub_helper, pub)):
+            for issue in collection:
+                if not self._add_embedded_worklogs(helper, issue, date_start, date_finish):
+                    self._add_worklogs(helper, issue, date_start, date_finish)
+
+        pub_collection = pub.filter_by_sk_key(sk_key).filter_by_worklog_date(date_start)
+        time_diff = pub_collection.total_worklogs_time(date_start) - \
+            sk_issue.worklogs.filter_by_date(date_start).total_time
+
+        if time_diff != 0:
+            self._sync_time([(sk_issue, pub_collection, date_start)])
+
+        return time_diff
+
     def _confirm(self, worklogs_diff):
         return click.confirm('Do you want to synchronize tasks %s?' % [item[0].key for item in worklogs_diff],
                              default=True)
@@ -93,67 +397,216 @@ class TimeSynchronizer(object):
             for issue in pub_collection.items[1:]:
                 click.echo('%s' % io.highlight_key(issue=issue))
 
+    def _print_record(self, date, time_diff, sk_key, sk_issue, pub_collection):
+        """
+        Print time differences as JSON line.
+        """
+        summary = sk_issue.summary if sk_issue else pub_collection.first().summary
+        sk_time = pub_collection.total_worklogs_time(date) - time_diff
+
+        io.record('time', date=date.strftime('%Y-%m-%d'), sk_key=sk_key,
+                  pub_keys=pub_collection.keys, sk_time=sk_time, pub_time=sk_time + time_diff, diff=time_diff,
+                  summary=summary)
+
     def _sync_time(self, items):
         """
         :type issue: IssuesCollection
         """
         for issue, pub_collection, date in items:
-            self._sk_helper.remove_worklogs(issue.data, issue.worklogs.filter_by_date(date))
+            remove = [worklog.id for worklog in issue.worklogs.filter_by_date(date)]
 
-            if pub_collection is None:
-                continue
+            add = []
+            for pub_issue in pub_collection or []:
+                add += [{'seconds': worklog.total_time, 'started': worklog.started,
+                         'comment': getattr(worklog, 'comment', None), 'pub_id': worklog.id}
+                        for worklog in pub_issue.worklogs.filter_by_date(date)]
 
-            for pub_issue in pub_collection:
-                [self._sk_helper.add_worklog(issue.data, worklog) for worklog in
-                 pub_issue.worklogs.filter_by_date(date)]
+            if self._coalesce and len(add) > 1:
+                add = [self._coalesce_worklogs(add)]
 
-            click.echo('Synchronized %s' % io.highlight_key(issue=issue))
+            plan = self._journal.plan(self._sk_helper.current_user, issue.id, issue.key, date, remove, add)
 
-    def _get_issues_collections(self, date_start, date_finish):
+            self._apply_plan(plan)
+
+            if not self._quiet:
+                click.echo('Synchronized %s' % io.highlight_key(issue=issue))
+
+    def _coalesce_worklogs(self, worklogs):
         """
-        Returns two collection of Issues for both of JIRAs.
+        Merge worklogs of a day into one: total time, the earliest start and all comments.
+
+        :type worklogs: list
+        :rtype: dict
         """
-        io.info('Getting issues...')
+        worklogs = sorted(worklogs, key=lambda worklog: jira_time_to_dt(worklog['started']))
 
-        sk_issues = self._sk_helper.issues_by_worklog_date_range(date_start, date_finish)
-        pub_issues = self._pub_helper.issues_by_worklog_date_range(date_start, date_finish)
+        return {
+            'seconds': sum(worklog['seconds'] for worklog in worklogs),
+            'started': worklogs[0]['started'],
+            'comment': '\n'.join(worklog['comment'] for worklog in worklogs if worklog['comment']) or None,
+            'pub_id': [worklog['pub_id'] for worklog in worklogs],
+        }
 
-        sk_collection = IssuesCollection(sk_issues)
-        pub_collection = PubIssuesCollection(pub_issues)
+    def _apply_plan(self, plan, resumed=False):
+        """
+        Applies operations of journal plan which aren't done yet.
 
-        sk_issues = self._sk_helper.issues(pub_collection.sk_keys)
-        pub_issues = self._pub_helper.get_issues_by_sk_links(sk_collection.links)
+        :param resumed: the plan was interrupted, so worklogs which are already in SK are not added again. The process
+        could be killed after a worklog was added but before it was journaled.
+        """
+        done = [tuple(item) for item in plan['done']]
 
-        sk_collection.merge(sk_issues)
-        pub_collection.merge(pub_issues)
+        for worklog_id in plan['remove']:
+            if ('remove', worklog_id) not in done:
+                self._sk_helper.remove_worklog_by_id(plan['issue_id'], worklog_id)
+                self._journal.done(plan, 'remove', worklog_id)
 
-        sk_collection = self._add_sk_worklogs(sk_collection, date_start, date_finish)
-        pub_collection = self._add_pub_worklogs(pub_collection, date_start, date_finish)
+        adds = [(index, worklog) for index, worklog in enumerate(plan['add']) if ('add', index) not in done]
+        landed = self._landed_worklogs(plan) if resumed and adds else []
 
-        return sk_collection, pub_collection
+        for index, worklog in adds:
+            started = (jira_time_to_dt(worklog['started']), worklog['seconds'])
 
-    def _add_sk_worklogs(self, collection, date_start, date_finish):
+            if started in landed:
+                landed.remove(started)
+            else:
+                self._sk_helper.add_worklog_values(plan['issue_key'], worklog['seconds'], worklog['started'],
+                                                   worklog['comment'])
+
+            self._journal.done(plan, 'add', index)
+
+        self._journal.commit(plan)
+
+    def _landed_worklogs(self, plan):
         """
-        Adds worklogs into SK collection and returns updated collection.
+        Get (started, seconds) of SK worklogs of the plan day which aren't removed by the plan.
+
+        :rtype: list
         """
-        with click.progressbar(collection, label='Getting SK worklogs ', length=len(collection.items)) as bar:
-            for issue in bar:
-                worklogs = self._sk_helper.get_worklogs_by_date(issue.data, date_start, date_finish)
+        day = dt.strptime(plan['date'], '%Y-%m-%d')
+        date_start = dt.fromtimestamp(time.mktime(day.timetuple()), tz=timezone.utc).astimezone()
+        date_finish = date_start.replace(hour=23, minute=59, second=59)
+
+        worklogs = self._sk_helper.get_worklogs_by_date(plan['issue_id'], date_start - timedelta(seconds=1),
+                                                        date_finish)
 
-                if worklogs:
-                    issue.worklogs.merge(worklogs)
+        removed = [str(worklog_id) for worklog_id in plan['remove']]
 
-        return collection
+        return [(jira_time_to_dt(worklog.started), int(worklog.timeSpentSeconds)) for worklog in worklogs
+                if str(worklog.id) not in removed]
 
-    def _add_pub_worklogs(self, collection, date_start, date_finish):
+    def resume(self):
         """
-        Adds worklogs into PUB collection and returns updated collection.
+        Finishes synchronizations which were interrupted, without fetching of issues.
+
+        :return: number of resumed plans.
         """
-        with click.progressbar(collection, label='Getting PUB worklogs', length=len(collection.items)) as bar:
-            for issue in bar:
-                worklogs = self._pub_helper.get_worklogs_by_date(issue.data, date_start, date_finish)
+        self._bypass_cache()
+
+        resumed = 0
+
+        for plan in self._journal.unfinished():
+            if plan['user'] != self._sk_helper.current_user:
+                io.info('Skipped %s of %s, it was started by %s' % (plan['issue_key'], plan['date'], plan['user']))
+                continue
+
+            self._apply_plan(plan, resumed=True)
+            resumed += 1
+
+            io.success('Synchronized %s for %s' % (plan['issue_key'], plan['date']))
 
-                if worklogs:
-                    issue.worklogs.merge(worklogs)
+        return resumed
+
+    def unfinished(self):
+        """
+        :return: list of interrupted synchronizations.
+        """
+        return self._journal.unfinished()
+
+    def _get_issues_collections(self, date_start, date_finish):
+        """
+        Returns two collection of Issues for both of JIRAs.
+
+        Both JIRAs are requested concurrently: each lookup starts as soon as its input is found and worklogs are
+        requested as soon as their issues are known.
+        """
+        if not self._quiet:
+            io.info('Getting issues...')
+
+        sk_collection = IssuesCollection([])
+        pub_collection = PubIssuesCollection([])
+
+        executor = self._executor or ThreadPoolExecutor(max_workers=self.FETCH_WORKERS)
+
+        try:
+            sk_search = executor.submit(self._sk_helper.issues_by_worklog_date_range, date_start, date_finish,
+                                        self._shard_days)
+            pub_search = executor.submit(self._pub_helper.issues_by_worklog_date_range, date_start, date_finish,
+                                         self._shard_days)
+
+            sk_lookup = then(executor, pub_search,
+                             lambda issues: self._sk_helper.issues(PubIssuesCollection(issues).sk_keys))
+            pub_lookup = then(executor, sk_search,
+                              lambda issues: self._pub_helper.get_issues_by_sk_links(IssuesCollection(issues).links))
+
+            stages = {
+                sk_search: (self._sk_helper, sk_collection),
+                sk_lookup: (self._sk_helper, sk_collection),
+                pub_search: (self._pub_helper, pub_collection),
+                pub_lookup: (self._pub_helper, pub_collection),
+            }
+
+            worklog_jobs = []
+
+            for stage in as_completed(stages):
+                helper, collection = stages[stage]
+
+                new_issues = OrderedDict(
+                    (issue.key, issue) for issue in stage.result() if not collection.contains(issue))
+                collection.merge(new_issues.values())
+
+                for key in new_issues:
+                    issue = collection.get(key)
+
+                    if not self._add_embedded_worklogs(helper, issue, date_start, date_finish):
+                        worklog_jobs.append(
+                            executor.submit(self._add_worklogs, helper, issue, date_start, date_finish))
+
+            if self._quiet:
+                [job.result() for job in as_completed(worklog_jobs)]
+            else:
+                with click.progressbar(as_completed(worklog_jobs), length=len(worklog_jobs),
+                                       label='Getting worklogs') as bar:
+                    for job in bar:
+                        job.result()
+        finally:
+            if executor is not self._executor:
+                executor.shutdown()
+
+        return sk_collection, pub_collection
+
+    def _add_embedded_worklogs(self, helper, issue, date_start, date_finish):
+        """
+        Adds worklogs from the search result into issue.
+
+        :type helper: JiraHelper
+        :return: False if the search result doesn't contain all worklogs of the issue.
+        """
+        worklogs = helper.get_embedded_worklogs_by_date(issue.data, date_start, date_finish)
+        if worklogs is None:
+            return False
+
+        issue.worklogs.merge(worklogs)
+
+        return True
+
+    def _add_worklogs(self, helper, issue, date_start, date_finish):
+        """
+        Requests worklogs of issue and adds them into it.
+
+        :type helper: JiraHelper
+        """
+        worklogs = helper.get_worklogs_by_date(issue.data, date_start, date_finish)
 
-        return collection
+        if worklogs:
+            issue.worklogs.merge(worklogs)
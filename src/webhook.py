@@ -0,0 +1,165 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.request import Request, urlopen
+
+from src.io import IO as io
+from src.jira_container import parse_key_from_issue_url
+from src.jira_helper import jira_time_to_dt
+
+
+class Debouncer(object):
+    """
+    Calls function once per key after there were no new calls for `delay` seconds.
+    """
+
+    def __init__(self, delay, fn):
+        self._delay = delay
+        self._fn = fn
+
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def push(self, key, *args):
+        with self._lock:
+            timer = self._timers.pop(key, None)
+            if timer is not None:
+                timer.cancel()
+
+            timer = self._timers[key] = threading.Timer(self._delay, self._fire, (key,) + args)
+            timer.daemon = True
+            timer.start()
+
+    def _fire(self, key, *args):
+        with self._lock:
+            self._timers.pop(key, None)
+
+        self._fn(*args)
+
+
+class WorklogWebhook(object):
+    """
+    Receiver of PUB worklog webhooks. Every event triggers time synchronization of its SK key and day.
+    """
+    EVENTS = ('worklog_created', 'worklog_updated', 'worklog_deleted')
+
+    DELAY = 5
+
+    def __init__(self, synchronizer, pub_jira, pub_user, delay=DELAY):
+        """
+        :type synchronizer: src.time_synchronizer.TimeSynchronizer
+        :type pub_jira: jira.JIRA
+        :param pub_user: only worklogs of this PUB user are synchronized.
+        """
+        self._synchronizer = synchronizer
+        self._pub_jira = pub_jira
+        self._pub_user = pub_user
+
+        self._sk_keys = {}
+        self._sync_lock = threading.Lock()
+        self._debouncer = Debouncer(delay, self._sync)
+
+    def handle(self, event):
+        """
+        :type event: dict
+
+        :return: (SK key, date) which will be synchronized or None if the event is skipped.
+        """
+        worklog = event.get('worklog')
+        if event.get('webhookEvent') not in self.EVENTS or not worklog:
+            return None
+
+        author = worklog.get('author', {}).get('name')
+        if author is not None and author != self._pub_user:
+            return None
+
+        sk_key = self._sk_key(worklog['issueId'])
+        if sk_key is None:
+            return None
+
+        date = jira_time_to_dt(worklog['started']).astimezone()
+
+        self._debouncer.push((sk_key, date.strftime('%Y-%m-%d')), sk_key, date)
+
+        return sk_key, date
+
+    def _sk_key(self, pub_issue_id):
+        if pub_issue_id not in self._sk_keys:
+            pub_issue = self._pub_jira.issue(pub_issue_id, fields='customfield_11470')
+
+            self._sk_keys[pub_issue_id] = parse_key_from_issue_url(getattr(pub_issue.fields, 'customfield_11470', None))
+
+        return self._sk_keys[pub_issue_id]
+
+    def _sync(self, sk_key, date):
+        with self._sync_lock:
+            try:
+                time_diff = self._synchronizer.sync_slice(sk_key, date)
+            except Exception as e:
+                io.error('%s %s: %s' % (sk_key, date.strftime('%Y-%m-%d'), e))
+                return
+
+            if time_diff is None:
+                io.error('Can\'t find the issue by key: %s' % sk_key)
+            else:
+                io.info('%s %s %s' % (date.strftime('%Y-%m-%d'), sk_key, io.highlight_time(time_diff)))
+
+    def serve(self, host, port):
+        server = WebhookServer((host, port), WebhookHandler)
+        server.webhook = self
+
+        io.info('Listening on http://%s:%d/' % (host, port))
+
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+
+class WebhookServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    webhook = None
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        try:
+            event = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+        except ValueError:
+            self.send_response(400)
+            self.end_headers()
+            return
+
+        try:
+            self.server.webhook.handle(event)
+        except Exception as e:
+            io.error(str(e))
+
+            self.send_response(500)
+            self.end_headers()
+            return
+
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def send_worklog_event(url, pub_key, started, event='worklog_updated', author=None):
+    """
+    Sends an event like PUB does, for checking of a local receiver.
+
+    :param started: JIRA formatted time of worklog.
+    :return: HTTP status
+    """
+    worklog = {'id': '0', 'issueId': pub_key, 'started': started}
+    if author:
+        worklog['author'] = {'name': author}
+
+    data = json.dumps({'webhookEvent': event, 'worklog': worklog}).encode('utf-8')
+
+    with urlopen(Request(url, data=data, headers={'Content-Type': 'application/json'})) as response:
+        return response.status